@@ -0,0 +1,403 @@
+""" Benchmarks for the hot paths of the YouTube collection pipeline.
+
+    Each benchmark runs against fake YouTube and BigQuery clients, so no API keys, quota or network
+    access are needed. Results are written to a JSON baseline file, and two baseline files can be
+    compared to flag throughput or memory regressions.
+
+    Benchmarks:
+        search_youtube          Parse a page of 50 search results
+        get_recent_youtube_vids Filter a page of random sample results to the search window
+        scrub_serializable      Make result rows JSON serializable for upload
+        upload_rows             Chunk and insert rows into a (fake) BigQuery table
+        get_keywords            Load a keyword CSV file
+        search_youtube_keywords Full keyword sweep, from keywords to upload, against stubbed clients
+"""
+
+import copy
+import csv
+import datetime
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from unittest import mock
+
+from docopt import docopt
+
+import youtube_sample
+import youtube_search
+from schemas import SCHEMA_YOUTUBE_SEARCH_RESULTS
+from utils import scrub_serializable, upload_rows
+from youtube_utils import search_youtube
+
+RESULTS_PER_PAGE = 50
+FAKE_CONFIG = {
+    'DEVELOPER_KEY': 'benchmark',
+    'BQ_KEY_FILE': None,
+    'PROJECT_ID': 'benchmark',
+    'DATASET': 'benchmark',
+    'SAVE_TABLE_SEARCH': 'benchmark',
+    'mailgun': None,
+}
+
+
+def main():
+    """ Run the pipeline benchmarks or compare two sets of results
+
+    Usage:
+      benchmark.py run [-v] [--output=file] [--repeat=n] [--scale=n] [<benchmark>...]
+      benchmark.py compare [--threshold=pct] <baseline_file> <current_file>
+
+    Options:
+      -h --help                 Show this screen.
+      -v --verbose              Print results as each benchmark finishes.
+      --output=file             Save results to this JSON file [default: benchmark_results.json]
+      --repeat=n                Number of timed runs for each benchmark; the fastest is kept [default: 5]
+      --scale=n                 Multiplier for the size of each benchmark workload [default: 1]
+      --threshold=pct           Percentage change in throughput or peak memory to flag as a regression [default: 10]
+
+    """
+
+    args = docopt(main.__doc__, version='YouTube Search Benchmarks 0.1')
+
+    if args['compare']:
+        regressions = compare_results(args['<baseline_file>'], args['<current_file>'],
+                                      threshold=float(args['--threshold']))
+        sys.exit(1 if regressions else 0)
+
+    # Keep the pipeline's own logging out of the timings
+    logging.getLogger().setLevel(logging.WARNING)
+    youtube_sample.logger.setLevel(logging.WARNING)
+
+    results = run_benchmarks(names=args['<benchmark>'] or None, repeat=int(args['--repeat']),
+                             scale=int(args['--scale']), verbose=args['--verbose'])
+    save_results(results, args['--output'])
+    print(format_results(results))
+
+
+class FakeRequest(object):
+    def __init__(self, response):
+        self.response = response
+
+    def execute(self):
+        return self.response
+
+
+class FakeYoutubeClient(object):
+    """ Stands in for the googleapiclient YouTube resource. Returns a full page of results for every
+        search, with publish times spread across (and slightly beyond) any requested window. """
+
+    def __init__(self, results_per_page=RESULTS_PER_PAGE):
+        self.results_per_page = results_per_page
+        self.calls = 0
+
+    def search(self):
+        return self
+
+    def list(self, **kwargs):
+        self.calls += 1
+        return FakeRequest(make_search_response(self.results_per_page,
+                                                published_after=kwargs.get('publishedAfter'),
+                                                published_before=kwargs.get('publishedBefore')))
+
+
+class FakeBigQueryTable(object):
+    def __init__(self, table_id):
+        self.table_id = table_id
+
+
+class FakeBigQueryClient(object):
+    """ Stands in for google.cloud.bigquery.Client. Accepts every insert. """
+
+    def __init__(self):
+        self.rows_inserted = 0
+        self.insert_calls = 0
+
+    def get_table(self, table_id):
+        return FakeBigQueryTable(table_id)
+
+    def insert_rows(self, table, rows):
+        self.insert_calls += 1
+        self.rows_inserted += len(rows)
+        return []
+
+
+def make_search_response(num_results, published_after=None, published_before=None):
+    if published_after and published_before:
+        ts_from = datetime.datetime.fromisoformat(published_after.rstrip("Z"))
+        ts_to = datetime.datetime.fromisoformat(published_before.rstrip("Z"))
+    else:
+        ts_to = datetime.datetime.utcnow()
+        ts_from = ts_to - datetime.timedelta(hours=1)
+
+    # Spread results over the window, plus 10% either side to exercise the window filter
+    span = (ts_to - ts_from) * 1.2
+    start = ts_from - (ts_to - ts_from) * 0.1
+
+    items = []
+    for i in range(num_results):
+        published = start + span * (i / max(num_results - 1, 1))
+        items.append({
+            "kind": "youtube#searchResult",
+            "id": {"kind": "youtube#video", "videoId": "vid{:08d}".format(i)},
+            "snippet": {
+                "publishedAt": published.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+                "title": "Benchmark video {}".format(i),
+                "channelTitle": "Benchmark channel {}".format(i % 7),
+                "description": "A description of benchmark video {} ".format(i) * 4,
+            }
+        })
+
+    return {"kind": "youtube#searchListResponse", "items": items}
+
+
+def make_result_rows(num_rows):
+    search_time = datetime.datetime.utcnow()
+    rows = []
+    for i in range(num_rows):
+        rows.append({
+            'publishedAt': search_time - datetime.timedelta(minutes=i),
+            'videoId': "vid{:08d}".format(i),
+            'title': "Benchmark video {}".format(i),
+            'channelTitle': "Benchmark channel {}".format(i % 7),
+            'description': "A description of benchmark video {} ".format(i) * 4,
+            'search_term': "keyword {}".format(i % 100),
+            'search_type': 'today',
+            'search_time': search_time,
+            'study_group': "group {}".format(i % 5),
+            'observatory_data_source': 'YouTube search from keywords',
+            'channelId': None,
+        })
+    return rows
+
+
+def make_keywords(num_keywords):
+    return [{'keyword': "keyword {}".format(i), 'study_group': "group {}".format(i % 5)}
+            for i in range(num_keywords)]
+
+
+def write_keyword_csv(file_name, num_keywords):
+    with open(file_name, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_ALL)
+        writer.writerow(['keyword', 'study_group', 'date_added', 'source'])
+        for entry in make_keywords(num_keywords):
+            writer.writerow([entry['keyword'], entry['study_group'], '2019-04-14', 'benchmark'])
+
+
+# Each setup function takes the workload scale and returns (function to time, prepare function, items per call).
+# The function to time is passed whatever the optional prepare function returns, so that per-run
+# state (like rows that scrub_serializable mutates) is rebuilt outside the timed section.
+
+def setup_search_youtube(scale):
+    client = FakeYoutubeClient()
+    pages = 20 * scale
+
+    def run(_):
+        for _ in range(pages):
+            search_youtube(client, 0, q='benchmark', maxResults=RESULTS_PER_PAGE)
+
+    return run, None, pages * RESULTS_PER_PAGE
+
+
+def setup_get_recent_youtube_vids(scale):
+    client = FakeYoutubeClient()
+    pages = 20 * scale
+
+    def run(_):
+        for _ in range(pages):
+            youtube_sample.get_recent_youtube_vids(client, seconds_between_calls=120, minutes_ago=2)
+
+    return run, None, pages * RESULTS_PER_PAGE
+
+
+def setup_scrub_serializable(scale):
+    num_rows = 5000 * scale
+    rows = make_result_rows(num_rows)
+
+    def prepare():
+        return copy.deepcopy(rows)
+
+    return scrub_serializable, prepare, num_rows
+
+
+def setup_upload_rows(scale):
+    num_rows = 5000 * scale
+    rows = make_result_rows(num_rows)
+
+    def prepare():
+        return copy.deepcopy(rows)
+
+    def run(prepared_rows):
+        upload_rows(SCHEMA_YOUTUBE_SEARCH_RESULTS, prepared_rows, FakeBigQueryClient(), 'benchmark', 'benchmark')
+
+    return run, prepare, num_rows
+
+
+def setup_get_keywords(scale):
+    num_keywords = 20000 * scale
+    tmp_dir = tempfile.mkdtemp(prefix='yt_benchmark_')
+    file_name = os.path.join(tmp_dir, 'keywords.csv')
+    write_keyword_csv(file_name, num_keywords)
+
+    def run(_):
+        for _ in youtube_search.get_keywords(file_name):
+            pass
+
+    return run, None, num_keywords
+
+
+def setup_search_youtube_keywords(scale):
+    keywords = make_keywords(50 * scale)
+    bq_client = FakeBigQueryClient()
+
+    def run(_):
+        with mock.patch.object(youtube_search, 'cfg', FAKE_CONFIG), \
+                mock.patch.object(youtube_search, 'yt_get_client', lambda developer_key: FakeYoutubeClient()), \
+                mock.patch.object(youtube_search, 'bq_get_clients', lambda project_id, json_key_file: (bq_client, None)):
+            youtube_search.search_youtube_keywords(keywords, max_search_results=RESULTS_PER_PAGE,
+                                                   search_type='today')
+
+    return run, None, len(keywords) * RESULTS_PER_PAGE
+
+
+BENCHMARKS = {
+    'search_youtube': setup_search_youtube,
+    'get_recent_youtube_vids': setup_get_recent_youtube_vids,
+    'scrub_serializable': setup_scrub_serializable,
+    'upload_rows': setup_upload_rows,
+    'get_keywords': setup_get_keywords,
+    'search_youtube_keywords': setup_search_youtube_keywords,
+}
+
+
+def run_benchmark(name, repeat=5, scale=1):
+    func, prepare, num_items = BENCHMARKS[name](scale)
+
+    timings = []
+    for _ in range(repeat):
+        arg = prepare() if prepare else None
+        start = time.perf_counter()
+        func(arg)
+        timings.append(time.perf_counter() - start)
+
+    # Measure memory in a separate, untimed run: tracemalloc slows everything down considerably
+    arg = prepare() if prepare else None
+    tracemalloc.start()
+    try:
+        func(arg)
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    best = min(timings)
+    return {
+        'items': num_items,
+        'repeat': repeat,
+        'best_seconds': best,
+        'mean_seconds': sum(timings) / len(timings),
+        'items_per_second': num_items / best if best else None,
+        'peak_memory_kb': peak_memory / 1024,
+    }
+
+
+def run_benchmarks(names=None, repeat=5, scale=1, verbose=False):
+    names = names or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        raise ValueError("Unknown benchmark(s): {}. Choose from: {}".format(", ".join(unknown), ", ".join(BENCHMARKS)))
+
+    results = {
+        'created': datetime.datetime.utcnow().isoformat("T") + "Z",
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'scale': scale,
+        'benchmarks': {},
+    }
+
+    for name in names:
+        results['benchmarks'][name] = run_benchmark(name, repeat=repeat, scale=scale)
+        if verbose:
+            print(format_result(name, results['benchmarks'][name]))
+
+    return results
+
+
+def save_results(results, file_name):
+    dir_name = os.path.dirname(file_name)
+    if dir_name:
+        os.makedirs(dir_name, exist_ok=True)
+
+    with open(file_name, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load_results(file_name):
+    with open(file_name, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def format_result(name, result):
+    return "{:<26} {:>14,.0f} items/s {:>10.4f} s best {:>12,.0f} KiB peak".format(
+        name, result['items_per_second'] or 0, result['best_seconds'], result['peak_memory_kb'])
+
+
+def format_results(results):
+    lines = ["Benchmarks (python {}, scale {}):".format(results['python'], results['scale'])]
+    for name, result in results['benchmarks'].items():
+        lines.append(format_result(name, result))
+    return "\n".join(lines)
+
+
+def compare_results(baseline_file, current_file, threshold=10.0):
+    """ Print a comparison of two benchmark result files and return a list of regressions.
+
+        A regression is a drop in throughput, or a rise in peak memory, of more than threshold percent. """
+
+    baseline = load_results(baseline_file)['benchmarks']
+    current = load_results(current_file)['benchmarks']
+
+    regressions = []
+    print("{:<26} {:>12} {:>12}".format("benchmark", "throughput", "memory"))
+    for name in sorted(set(baseline) & set(current)):
+        base, cur = baseline[name], current[name]
+        throughput_change = percent_change(base['items_per_second'], cur['items_per_second'])
+        memory_change = percent_change(base['peak_memory_kb'], cur['peak_memory_kb'])
+
+        flags = []
+        if throughput_change is not None and throughput_change < -threshold:
+            flags.append('THROUGHPUT REGRESSION')
+        if memory_change is not None and memory_change > threshold:
+            flags.append('MEMORY REGRESSION')
+        if flags:
+            regressions.append((name, flags))
+
+        print("{:<26} {:>11}% {:>11}% {}".format(name, format_change(throughput_change),
+                                                format_change(memory_change), ", ".join(flags)))
+
+    for name in sorted(set(baseline) ^ set(current)):
+        print("{:<26} only in {}".format(name, baseline_file if name in baseline else current_file))
+
+    if regressions:
+        print("\n{} regression(s) beyond {}%.".format(len(regressions), threshold))
+    else:
+        print("\nNo regressions beyond {}%.".format(threshold))
+
+    return regressions
+
+
+def percent_change(base, current):
+    if not base or current is None:
+        return None
+    return (current - base) / base * 100
+
+
+def format_change(change):
+    return "n/a" if change is None else "{:+.1f}".format(change)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+""" Yield-adaptive keyword scheduling: spend a run's quota on the keywords most likely to find new videos.
+
+    Every search.list call costs 100 quota units whether it finds 50 new videos or none. The scheduler
+    records, for each keyword and search type, how many new (never seen before) videoIds each search
+    found, and keeps an exponentially weighted average of that yield.
+
+    Each run, keywords are chosen with an upper confidence bound (UCB) bandit policy: a keyword's score
+    is its average yield plus an exploration bonus that shrinks the more often it has been searched.
+    Keywords never searched before, and keywords skipped for max_skipped_runs runs in a row, are always
+    searched first, so low-yield keywords are still checked, just less often.
+
+    State is kept in a JSON file between runs.
+"""
+
+import json
+import math
+import os
+
+from metrics import NEW_VIDEOS, SEARCH_QUOTA_COST
+
+# Weight given to the latest observation in the average yield
+YIELD_SMOOTHING = 0.3
+
+# Number of videoIds remembered to decide whether a result is new
+MAX_SEEN_VIDEO_IDS = 500000
+
+
+class KeywordYieldScheduler(object):
+    def __init__(self, state_file, exploration=1.0, max_skipped_runs=10, max_seen_video_ids=MAX_SEEN_VIDEO_IDS):
+        self.state_file = state_file
+        self.exploration = exploration
+        self.max_skipped_runs = max_skipped_runs
+        self.max_seen_video_ids = max_seen_video_ids
+
+        self.runs = 0
+        self.keywords = {}  # key -> {'calls', 'new_videos', 'yield', 'last_run'}
+        self._seen = {}  # videoId -> None, in insertion order so the oldest can be dropped
+
+        self.load()
+
+    @staticmethod
+    def key(entry, search_type):
+        return "{}\t{}\t{}".format(search_type, entry['study_group'], entry['keyword'])
+
+    def load(self):
+        if not self.state_file or not os.path.exists(self.state_file):
+            return
+
+        with open(self.state_file, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        self.runs = state.get('runs', 0)
+        self.keywords = state.get('keywords', {})
+        self._seen = dict.fromkeys(state.get('seen_video_ids', []))
+
+    def save(self):
+        dir_name = os.path.dirname(self.state_file)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+
+        state = {
+            'runs': self.runs,
+            'keywords': self.keywords,
+            'seen_video_ids': list(self._seen),
+        }
+
+        # Write to a temporary file first, so a crash never leaves a half written state file
+        tmp_file = self.state_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_file, self.state_file)
+
+    def score(self, stats, total_calls, yield_scale=1.0):
+        """ UCB1 score. Yields are counts of videos rather than 0-1 rewards, so the exploration bonus is
+            scaled by the best average yield seen. """
+        if not stats or not stats['calls']:
+            return float('inf')
+        bonus = math.sqrt(2 * math.log(total_calls + 1) / stats['calls'])
+        return stats['yield'] + self.exploration * yield_scale * bonus
+
+    def select(self, keywords, search_type, quota_units):
+        """ Return the keywords to search this run, given a budget of quota_units.
+
+            Keywords are returned in the order they should be searched: those that must be searched
+            (new, or overdue for a revisit) first, most overdue first, then by score. """
+
+        budget = int(quota_units // SEARCH_QUOTA_COST)
+        total_calls = sum(stats['calls'] for stats in self.keywords.values())
+        yield_scale = max([stats['yield'] for stats in self.keywords.values()] + [1.0])
+
+        due = []
+        scored = []
+        for entry in keywords:
+            stats = self.keywords.get(self.key(entry, search_type))
+            if not stats:
+                due.append((float('inf'), entry))
+            elif self.runs - stats['last_run'] >= self.max_skipped_runs:
+                due.append((self.runs - stats['last_run'], entry))
+            else:
+                scored.append((self.score(stats, total_calls, yield_scale), entry))
+
+        due.sort(key=lambda item: item[0], reverse=True)
+        scored.sort(key=lambda item: item[0], reverse=True)
+        selected = [entry for _, entry in due + scored][:budget]
+
+        self.runs += 1
+        return selected
+
+    def record(self, searched_keywords, results, search_type, failed_keywords=()):
+        """ Update each searched keyword's yield from the results of this run.
+
+            Keywords in failed_keywords, whose search call failed, are left as if they had not been
+            searched. Returns the total number of new videos found. """
+
+        failed = set(self.key(entry, search_type) for entry in failed_keywords)
+
+        new_by_keyword = {}
+        for row in results:
+            video_id = row.get('videoId')
+            if video_id is None or video_id in self._seen:
+                continue
+            self._seen[video_id] = None
+            key = self.key({'keyword': row['search_term'], 'study_group': row['study_group']}, search_type)
+            new_by_keyword[key] = new_by_keyword.get(key, 0) + 1
+
+        for entry in searched_keywords:
+            key = self.key(entry, search_type)
+            if key in failed:
+                continue
+            new_videos = new_by_keyword.get(key, 0)
+            stats = self.keywords.get(key)
+            if stats is None:
+                stats = {'calls': 0, 'new_videos': 0, 'yield': float(new_videos), 'last_run': self.runs}
+                self.keywords[key] = stats
+            else:
+                stats['yield'] = (1 - YIELD_SMOOTHING) * stats['yield'] + YIELD_SMOOTHING * new_videos
+            stats['calls'] += 1
+            stats['new_videos'] += new_videos
+            stats['last_run'] = self.runs
+
+        if len(self._seen) > self.max_seen_video_ids:
+            self._seen = dict.fromkeys(list(self._seen)[-self.max_seen_video_ids:])
+
+        total_new = sum(new_by_keyword.values())
+        NEW_VIDEOS.inc(total_new, search_type=search_type)
+        return total_new
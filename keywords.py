@@ -0,0 +1,134 @@
+""" Streaming keyword sources for youtube_search.
+
+    Keywords are read lazily from CSV, JSON lines or Parquet files, so a search can start on the first
+    keyword without loading the whole file, and memory use stays bounded for very large keyword lists.
+
+    Each entry is a dict with 'keyword' and 'study_group'. Whitespace is normalised, entries with an empty
+    keyword are skipped, and repeated keyword/study_group pairs (ignoring case) are only returned once.
+    Unreadable JSON lines are skipped with a warning, rather than failing a search part way through.
+"""
+
+import csv
+import json
+import logging
+import os
+
+REQUIRED_COLUMNS = ('keyword', 'study_group')
+
+# Number of rows read from a Parquet file at a time
+PARQUET_BATCH_SIZE = 10000
+
+
+def iter_keywords(file_name, file_format=None, deduplicate=True):
+    """ Return an iterator of {'keyword': ..., 'study_group': ...} dicts from file_name.
+
+        The file format is taken from the extension (.csv, .jsonl/.ndjson/.json, .parquet) unless
+        file_format is given. The required columns are checked before this returns, so a bad file
+        fails immediately rather than part way through a search. """
+
+    file_format = file_format or guess_format(file_name)
+    readers = {'csv': _read_csv, 'jsonl': _read_jsonl, 'parquet': _read_parquet}
+    if file_format not in readers:
+        raise ValueError("Unsupported keyword file format '{}'. Use one of: {}".format(
+            file_format, ", ".join(readers)))
+
+    rows = readers[file_format](file_name)
+
+    # Readers validate columns before yielding their first row, so start them now
+    try:
+        first = next(rows)
+    except StopIteration:
+        return iter(())
+
+    return _normalise(_chain_first(first, rows), deduplicate=deduplicate)
+
+
+def guess_format(file_name):
+    extension = os.path.splitext(file_name)[1].lower()
+    if extension in ('.jsonl', '.ndjson', '.json'):
+        return 'jsonl'
+    if extension in ('.parquet', '.pq'):
+        return 'parquet'
+    return 'csv'
+
+
+def normalise_text(value):
+    """ Strip and collapse whitespace. Missing values become an empty string. """
+    if value is None:
+        return ""
+    return " ".join(str(value).split())
+
+
+def _check_columns(file_name, columns):
+    missing = [column for column in REQUIRED_COLUMNS if column not in columns]
+    if missing:
+        raise ValueError("Invalid keyword file {}. Must contain columns: {}. Missing: {}".format(
+            file_name, ", ".join(REQUIRED_COLUMNS), ", ".join(missing)))
+
+
+def _chain_first(first, rows):
+    yield first
+    yield from rows
+
+
+def _normalise(rows, deduplicate=True):
+    seen = set()
+    for keyword, study_group in rows:
+        keyword = normalise_text(keyword)
+        study_group = normalise_text(study_group)
+        if not keyword:
+            continue
+
+        if deduplicate:
+            key = (keyword.casefold(), study_group.casefold())
+            if key in seen:
+                continue
+            seen.add(key)
+
+        yield {'keyword': keyword, 'study_group': study_group}
+
+
+def _read_csv(file_name):
+    # utf-8-sig drops the byte order mark that Excel puts at the start of CSV files
+    with open(file_name, 'r', encoding='utf-8-sig', newline='') as f:
+        reader = csv.DictReader(f)
+        _check_columns(file_name, reader.fieldnames or [])
+        for row in reader:
+            yield row['keyword'], row['study_group']
+
+
+def _read_jsonl(file_name):
+    with open(file_name, 'r', encoding='utf-8-sig') as f:
+        checked = False
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            if not isinstance(row, dict):
+                logging.getLogger().warning("Skipping unreadable line {} in keyword file {}.".format(
+                    line_number, file_name))
+                continue
+
+            if not checked:
+                _check_columns(file_name, row)
+                checked = True
+
+            yield row.get('keyword'), row.get('study_group')
+
+
+def _read_parquet(file_name):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Reading Parquet keyword files requires pyarrow (pip install pyarrow): {}".format(e))
+
+    parquet_file = pq.ParquetFile(file_name)
+    _check_columns(file_name, parquet_file.schema_arrow.names)
+
+    for batch in parquet_file.iter_batches(batch_size=PARQUET_BATCH_SIZE, columns=list(REQUIRED_COLUMNS)):
+        columns = batch.to_pydict()
+        yield from zip(columns['keyword'], columns['study_group'])
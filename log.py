@@ -1,15 +1,30 @@
+import atexit
 import logging
+import queue
 import socket
+import sys
 import threading
-from logging.handlers import RotatingFileHandler
-from traceback import format_exc
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from traceback import extract_tb, format_exc
 from config import cfg
+from metrics import ALERTS_SENT, ALERTS_SUPPRESSED, REGISTRY
+from profiler import PROFILER
 
 from requests import post
 
 _initalised = False
 _LOGGER_NAME = 'LegitLogger'
 
+# Alerting defaults, overridden by ALERT_MIN_SECONDS_BETWEEN_EMAILS and ALERT_DEDUP_SECONDS in config.yml
+_ALERT_MIN_SECONDS_BETWEEN_EMAILS = 300
+_ALERT_DEDUP_SECONDS = 3600
+
+# Connect and read timeout for Mailgun, so one hung request can't hold up every later alert
+_MAIL_TIMEOUT_SECONDS = 10
+
 
 class CountsHandler(logging.Handler):
     def __init__(self, level=logging.NOTSET):
@@ -56,12 +71,13 @@ def setup_logging(log_file_name=None, verbose=False, interactive_only=False):
     logFormatter = logging.Formatter(
         "%(asctime)s [%(filename)-20.20s:%(lineno)-4.4s - %(funcName)-20.20s() [%(threadName)-12.12s] [%(levelname)-8.8s]  %(message).5000s")
     logger = logging.getLogger(_LOGGER_NAME)
+    handlers = []
 
     consoleHandler = logging.StreamHandler()
     consoleHandler.setFormatter(logFormatter)
-    logger.addHandler(consoleHandler)
+    handlers.append(consoleHandler)
 
-    # Add logger to count number of errors
+    # Add logger to count number of errors. This is cheap, so it stays on the calling thread.
     countsHandler = CountsHandler()
     logger.addHandler(countsHandler)
 
@@ -79,9 +95,9 @@ def setup_logging(log_file_name=None, verbose=False, interactive_only=False):
         else:
             fileHandler.setLevel(logging.INFO)
 
-        logger.addHandler(fileHandler)
+        handlers.append(fileHandler)
 
-    # Add
+    start_queue_logging(logger, handlers)
 
     if verbose:
         logger.setLevel(logging.DEBUG)
@@ -93,6 +109,18 @@ def setup_logging(log_file_name=None, verbose=False, interactive_only=False):
     return logger
 
 
+def start_queue_logging(logger, handlers):
+    """ Attach handlers to logger through a queue, so that formatting and writing records happens on a
+        background thread rather than in the caller. The queue is drained when the process exits. """
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    logger.addHandler(QueueHandler(log_queue))
+    return listener
+
+
 run_summary = {
     'summary_log_messages': [],
     'summary_counts': {},
@@ -132,6 +160,14 @@ def get_log_summary(reset_summary=False):
     for key, value in run_summary['summary_counts'].items():
         message_body += "{key}: {value}\n".format(key=key, value=value)
 
+    metrics_summary = REGISTRY.get_summary()
+    if metrics_summary:
+        message_body += "\n\nMetrics:\n" + metrics_summary
+
+    profile_summary = PROFILER.get_summary()
+    if profile_summary:
+        message_body += "\n\nProfile:\n" + profile_summary
+
     logger = getLogger()
 
     for handlerobj in logger.handlers:
@@ -167,20 +203,164 @@ def print_run_summary(subject, log_file=None, reset_summary=True, send_email=Fal
         init_run_summary() # Not sure why the run summary is not being reset in the get_log_summary() function.
 
 
-def send_update_mail(subject, message):
+@lru_cache(maxsize=None)
+def get_host_address():
+    """ Resolve this host's name and addresses once; a DNS lookup per email can block for seconds """
     try:
-        hostname = socket.gethostname()
-        full_address = socket.gethostbyname_ex(hostname)
-        send_mail({
-            "subject": subject,
-            "text": str(message) + "\n" +
-                    "From {host}.".format(
-                        host=full_address
-                    )
-        }
-        )
+        return socket.gethostbyname_ex(socket.gethostname())
     except Exception as e:
-        logger.exception("Unable to send error mail: {}".format(e), exc_info=True)
+        logger.error("Unable to resolve hostname: {}".format(e))
+        return socket.gethostname()
+
+
+class AlertDispatcher(object):
+    """ Sends emails from a background thread so that callers never wait on the mail server.
+
+        Error alerts are grouped by signature (module, exception type and where it was raised):
+          * Repeats of an alert that was emailed less than dedup_seconds ago are only counted.
+          * At most one email is sent every min_seconds_between_emails. Alerts that arrive in between
+            are sent together as a digest, with a count for each signature.
+    """
+
+    _STOP = object()
+
+    def __init__(self, send_func=None, min_seconds_between_emails=_ALERT_MIN_SECONDS_BETWEEN_EMAILS,
+                 dedup_seconds=_ALERT_DEDUP_SECONDS):
+        self.send_func = send_func or send_mail
+        self.min_seconds_between_emails = min_seconds_between_emails
+        self.dedup_seconds = dedup_seconds
+
+        self._queue = queue.Queue()
+        self._pending = OrderedDict()  # signature -> alert waiting to be sent
+        self._suppressed = OrderedDict()  # signature -> number of repeats not emailed
+        self._last_sent = {}  # signature -> time it was last included in an email
+        self._last_email_time = None
+
+        self._thread = threading.Thread(target=self._run, name='AlertDispatcher', daemon=True)
+        self._thread.start()
+
+    def submit_alert(self, signature, subject, text):
+        self._queue.put(('alert', time.monotonic(), signature, subject, text))
+
+    def submit_mail(self, message_dict):
+        """ Send an email without deduplication or rate limiting """
+        self._queue.put(('mail', message_dict))
+
+    def stop(self, timeout=30):
+        """ Send anything still pending and stop the background thread """
+        self._queue.put(self._STOP)
+        self._thread.join(timeout)
+
+    def _seconds_until_send(self):
+        if not self._pending:
+            return None
+        if self._last_email_time is None:
+            return 0
+        return max(0, self._last_email_time + self.min_seconds_between_emails - time.monotonic())
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self._seconds_until_send())
+            except queue.Empty:
+                item = None
+
+            if item is self._STOP:
+                self._flush()
+                return
+            elif item and item[0] == 'alert':
+                self._add_alert(*item[1:])
+            elif item and item[0] == 'mail':
+                self._send(item[1])
+
+            if self._pending and self._seconds_until_send() == 0:
+                self._flush()
+
+    def _add_alert(self, received_time, signature, subject, text):
+        if signature in self._pending:
+            self._pending[signature]['count'] += 1
+        elif signature in self._last_sent and received_time - self._last_sent[signature] < self.dedup_seconds:
+            self._suppressed[signature] = self._suppressed.get(signature, 0) + 1
+            ALERTS_SUPPRESSED.inc()
+        else:
+            self._pending[signature] = {'subject': subject, 'text': text, 'count': 1}
+
+    def _flush(self):
+        if not self._pending:
+            return
+
+        alerts = list(self._pending.items())
+        if len(alerts) == 1 and not self._suppressed:
+            signature, alert = alerts[0]
+            subject = alert['subject']
+            if alert['count'] > 1:
+                subject += " (x{})".format(alert['count'])
+            text = alert['text']
+        else:
+            occurrences = sum(alert['count'] for _, alert in alerts)
+            subject = "Error digest: {} distinct errors, {} occurrences".format(len(alerts), occurrences)
+            text = ""
+            for signature, alert in alerts:
+                text += "{count} x {subject}\n{text}\n\n".format(**alert)
+            if self._suppressed:
+                text += "Repeats of errors already reported in the last {} seconds:\n".format(self.dedup_seconds)
+                for signature, count in self._suppressed.items():
+                    text += "{} x {}\n".format(count, signature)
+
+        self._send({"subject": subject, "text": text + "\nFrom {host}.".format(host=get_host_address())})
+        ALERTS_SENT.inc(len(alerts))
+
+        now = time.monotonic()
+        for signature, _ in alerts:
+            self._last_sent[signature] = now
+        self._last_email_time = now
+        self._pending = OrderedDict()
+        self._suppressed = OrderedDict()
+
+    def _send(self, message_dict):
+        try:
+            self.send_func(message_dict)
+        except Exception as e:
+            logger.error("Unable to send error mail: {}".format(e))
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_alert_dispatcher():
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            config = cfg or {}
+            _dispatcher = AlertDispatcher(
+                min_seconds_between_emails=config.get('ALERT_MIN_SECONDS_BETWEEN_EMAILS') or _ALERT_MIN_SECONDS_BETWEEN_EMAILS,
+                dedup_seconds=config.get('ALERT_DEDUP_SECONDS') or _ALERT_DEDUP_SECONDS)
+            atexit.register(_dispatcher.stop)
+        return _dispatcher
+
+
+def get_error_signature(module_name=None, message=None):
+    """ Identify an error by module, exception type and the line it was raised from, so that repeats of
+        the same failure are grouped together even when their messages differ. """
+    exc_type, exc_value, exc_tb = sys.exc_info()
+    if exc_type is None:
+        return "{}: {}".format(module_name, message)
+
+    frames = extract_tb(exc_tb)
+    location = "{}:{}".format(frames[-1].filename, frames[-1].lineno) if frames else ""
+    return "{}: {} at {}".format(module_name, exc_type.__name__, location)
+
+
+def send_update_mail(subject, message):
+    get_alert_dispatcher().submit_mail({
+        "subject": subject,
+        "text": str(message) + "\n" +
+                "From {host}.".format(
+                    host=get_host_address()
+                )
+    }
+    )
 
 
 def send_exception(module_name=None, message=None, message_body=None):
@@ -188,22 +368,14 @@ def send_exception(module_name=None, message=None, message_body=None):
         logger.exception(message, exc_info=True)
     if message_body:
         message = message_body[:2500]
-    try:
-        hostname = socket.gethostname()
-        full_address = socket.gethostbyname_ex(hostname)
-        subject = "[{}] Unexpected Error: {}".format(module_name, message)
-        send_mail({
-            "subject": subject,
-            "text":
-                "Unexpected Error, please check your instance {host}.\n{message}\n{traceback}".format(
-                    host=full_address,
-                    message=message_body,
-                    traceback=format_exc()[:2500],
-                )
-        }
-        )
-    except Exception as e:
-        logger.error("Unable to send error mail: {}".format(e))
+
+    # The traceback and signature must be captured here, while the exception is still being handled
+    subject = "[{}] Unexpected Error: {}".format(module_name, message)
+    text = "Unexpected Error, please check your instance.\n{message}\n{traceback}".format(
+        message=message_body,
+        traceback=format_exc()[:2500],
+    )
+    get_alert_dispatcher().submit_alert(get_error_signature(module_name, message), subject, text)
 
 
 def send_mail(message_dict):
@@ -220,7 +392,7 @@ def send_mail(message_dict):
         data.update(message_dict)
         logger.info("Sent error email to {}.".format(cfg['mailgun']['email_to_notify']))
 
-        return post(api_base_url, auth=auth, data=data)
+        return post(api_base_url, auth=auth, data=data, timeout=_MAIL_TIMEOUT_SECONDS)
     else:
         logger.info("Not sending email - mailgun is not configured.")
         return None
\ No newline at end of file
@@ -0,0 +1,266 @@
+""" Lightweight metrics for instrumenting the collection pipeline.
+
+    Counters, gauges and histograms are kept in a process-wide registry. They can be served over HTTP in
+    the Prometheus text exposition format (start_metrics_server), and are included in the run summary
+    printed by log.print_run_summary.
+
+    Metrics are updated from multiple threads, so every update takes the metric's lock.
+"""
+
+import threading
+from time import perf_counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# Default histogram buckets, in seconds, suited to API calls and BigQuery inserts
+DEFAULT_LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(label_key):
+    if not label_key:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                          for k, v in label_key) + "}"
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class Metric(object):
+    metric_type = None
+
+    def __init__(self, name, description=""):
+        self.name = name
+        self.description = description
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def samples(self):
+        """ Return a list of (name, label_key, value) tuples for export """
+        with self._lock:
+            return [(self.name, key, value) for key, value in sorted(self._values.items())]
+
+    def reset(self):
+        with self._lock:
+            self._values = {}
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.description),
+                 "# TYPE {} {}".format(self.name, self.metric_type)]
+        for name, label_key, value in self.samples():
+            lines.append("{}{} {}".format(name, _format_labels(label_key), _format_value(value)))
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    metric_type = "counter"
+
+    def inc(self, value=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(_label_key(labels), 0)
+
+
+class Gauge(Metric):
+    metric_type = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def inc(self, value=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def dec(self, value=1, **labels):
+        self.inc(-value, **labels)
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(_label_key(labels), 0)
+
+
+class Histogram(Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name, description="", buckets=DEFAULT_LATENCY_BUCKETS):
+        super(Histogram, self).__init__(name, description)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = {'buckets': [0] * len(self.buckets), 'sum': 0, 'count': 0, 'max': value}
+                self._values[key] = state
+            for i, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    state['buckets'][i] += 1
+                    break
+            state['sum'] += value
+            state['count'] += 1
+            state['max'] = max(state['max'], value)
+
+    def time(self, **labels):
+        """ Context manager that observes the time taken by the block it wraps """
+        return _Timer(self, labels)
+
+    def get(self, **labels):
+        """ Return the count, sum and max of observations for these labels """
+        with self._lock:
+            state = self._values.get(_label_key(labels))
+            if state is None:
+                return {'count': 0, 'sum': 0, 'max': None}
+            return {'count': state['count'], 'sum': state['sum'], 'max': state['max']}
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, state in sorted(self._values.items()):
+                cumulative = 0
+                for upper_bound, count in zip(self.buckets, state['buckets']):
+                    cumulative += count
+                    samples.append((self.name + "_bucket", key + (('le', _format_value(float(upper_bound))),),
+                                    cumulative))
+                samples.append((self.name + "_sum", key, state['sum']))
+                samples.append((self.name + "_count", key, state['count']))
+        return samples
+
+
+class _Timer(object):
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.elapsed = perf_counter() - self.start
+        self.histogram.observe(self.elapsed, **self.labels)
+        return False
+
+
+class MetricsRegistry(object):
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, description, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, description, **kwargs)
+                self._metrics[name] = metric
+            elif not isinstance(metric, cls):
+                raise ValueError("Metric {} is already registered as a {}.".format(name, metric.metric_type))
+            return metric
+
+    def counter(self, name, description=""):
+        return self._get_or_create(Counter, name, description)
+
+    def gauge(self, name, description=""):
+        return self._get_or_create(Gauge, name, description)
+
+    def histogram(self, name, description="", buckets=DEFAULT_LATENCY_BUCKETS):
+        return self._get_or_create(Histogram, name, description, buckets=buckets)
+
+    def metrics(self):
+        with self._lock:
+            return [self._metrics[name] for name in sorted(self._metrics)]
+
+    def reset(self):
+        for metric in self.metrics():
+            metric.reset()
+
+    def render_prometheus(self):
+        return "\n".join(metric.render() for metric in self.metrics()) + "\n"
+
+    def get_summary(self):
+        """ Return a human readable summary of all metrics for the run summary """
+        message_body = ""
+        for metric in self.metrics():
+            if isinstance(metric, Histogram):
+                with metric._lock:
+                    states = sorted(metric._values.items())
+                for key, state in states:
+                    mean = state['sum'] / state['count'] if state['count'] else 0
+                    message_body += "{name}{labels}: count {count}, mean {mean:.3f}, max {max:.3f}\n".format(
+                        name=metric.name, labels=_format_labels(key), count=state['count'], mean=mean,
+                        max=state['max'])
+            else:
+                for name, key, value in metric.samples():
+                    message_body += "{name}{labels}: {value}\n".format(name=name, labels=_format_labels(key),
+                                                                       value=_format_value(value))
+        return message_body
+
+
+REGISTRY = MetricsRegistry()
+
+# Pipeline metrics
+API_CALL_SECONDS = REGISTRY.histogram('youtube_api_call_seconds', "Latency of YouTube API search calls.")
+API_ERRORS = REGISTRY.counter('youtube_api_errors_total', "YouTube API search calls that failed.")
+QUOTA_UNITS = REGISTRY.counter('youtube_quota_units_total', "YouTube API quota units spent.")
+NEW_VIDEOS = REGISTRY.counter('youtube_new_videos_total',
+                              "Search results with a videoId not seen before by the keyword yield scheduler.")
+RESULTS_PER_KEYWORD = REGISTRY.histogram('youtube_results_per_keyword', "Search results returned for each keyword.",
+                                         buckets=(0, 1, 5, 10, 20, 30, 40, 50))
+WINDOW_SATURATION = REGISTRY.gauge('youtube_sample_window_saturation',
+                                   "Share of the maximum page size returned by the last random sample search. "
+                                   "Values near 1 mean the search window is too wide and videos are being missed.")
+SATURATED_WINDOWS = REGISTRY.counter('youtube_sample_saturated_windows_total',
+                                     "Random sample searches that returned a full page of results.")
+UPLOAD_CHUNK_SECONDS = REGISTRY.histogram('bigquery_upload_chunk_seconds', "Latency of BigQuery chunk inserts.")
+ROWS_UPLOADED = REGISTRY.counter('bigquery_rows_total', "Rows sent to BigQuery, by outcome.")
+QUEUE_DEPTH = REGISTRY.gauge('youtube_sample_queue_depth', "Videos collected and waiting to be saved.")
+ROWS_SPOOLED = REGISTRY.counter('backup_rows_spooled_total', "Rows written to backup files for later upload.")
+ALERTS_SENT = REGISTRY.counter('alerts_sent_total', "Distinct error alerts emailed.")
+ALERTS_SUPPRESSED = REGISTRY.counter('alerts_suppressed_total',
+                                     "Error alerts not emailed because the same error was reported recently.")
+
+# Cost of a search.list call, in quota units
+SEARCH_QUOTA_COST = 100
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+
+        body = self.registry.render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Don't write a line to stderr for every scrape
+        pass
+
+
+def start_metrics_server(port, host='127.0.0.1', registry=REGISTRY):
+    """ Serve metrics in the Prometheus text format at http://host:port/metrics from a daemon thread """
+    handler = type('MetricsRequestHandler', (_MetricsRequestHandler,), {'registry': registry})
+    server = HTTPServer((host, int(port)), handler)
+    thread = threading.Thread(target=server.serve_forever, name='MetricsServer', daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,122 @@
+""" Local columnar sink: write result rows to Parquet files for offline analysis and cheap archiving.
+
+    Rows are converted straight into Arrow record batches, one column at a time, and written to
+    Hive-style partitions by collection hour and data source:
+
+        <output_dir>/search_hour=2019041405/observatory_data_source=YouTube%20random%20sample/part-....parquet
+
+    The repetitive search_term and study_group columns (and the other low-cardinality strings) are
+    dictionary encoded.
+
+    Requires pyarrow (pip install pyarrow).
+"""
+
+import datetime
+import os
+import uuid
+from urllib.parse import quote
+
+from dateutil import parser
+
+from schemas import SCHEMA_YOUTUBE_SEARCH_RESULTS
+
+PARTITION_TIME_COLUMN = 'search_time'
+PARTITION_SOURCE_COLUMN = 'observatory_data_source'
+DICTIONARY_COLUMNS = ('search_term', 'study_group', 'search_type', 'observatory_data_source')
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("The parquet sink requires pyarrow (pip install pyarrow): {}".format(e))
+    return pyarrow, pyarrow.parquet
+
+
+def arrow_schema(schema=SCHEMA_YOUTUBE_SEARCH_RESULTS):
+    """ Convert a BigQuery schema (as in schemas.py) to an Arrow schema """
+    pa, _ = _import_pyarrow()
+
+    types = {
+        'STRING': pa.string(),
+        'TIMESTAMP': pa.timestamp('us', tz='UTC'),
+        'INTEGER': pa.int64(),
+        'FLOAT': pa.float64(),
+        'BOOLEAN': pa.bool_(),
+    }
+
+    fields = []
+    for field in schema:
+        if field['name'] in DICTIONARY_COLUMNS and field['type'] == 'STRING':
+            arrow_type = pa.dictionary(pa.int32(), pa.string())
+        else:
+            arrow_type = types[field['type']]
+        fields.append(pa.field(field['name'], arrow_type))
+    return pa.schema(fields)
+
+
+def _to_datetime(value):
+    # Rows that have already been through scrub_serializable hold ISO format strings
+    if isinstance(value, str):
+        return parser.parse(value)
+    return value
+
+
+def rows_to_record_batch(rows, schema=SCHEMA_YOUTUBE_SEARCH_RESULTS):
+    """ Build an Arrow record batch from a list of row dicts. Columns not in the schema are ignored. """
+    pa, _ = _import_pyarrow()
+    target_schema = arrow_schema(schema)
+
+    arrays = []
+    for field, arrow_field in zip(schema, target_schema):
+        name = field['name']
+        if field['type'] == 'TIMESTAMP':
+            values = [_to_datetime(row.get(name)) for row in rows]
+        else:
+            values = [row.get(name) for row in rows]
+
+        if pa.types.is_dictionary(arrow_field.type):
+            arrays.append(pa.array(values, type=pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(values, type=arrow_field.type))
+
+    return pa.RecordBatch.from_arrays(arrays, schema=target_schema)
+
+
+def partition_key(row):
+    search_time = _to_datetime(row.get(PARTITION_TIME_COLUMN))
+    if search_time is None:
+        hour = 'unknown'
+    else:
+        if search_time.tzinfo is not None:
+            search_time = search_time.astimezone(datetime.timezone.utc)
+        hour = search_time.strftime('%Y%m%d%H')
+    return hour, row.get(PARTITION_SOURCE_COLUMN) or 'unknown'
+
+
+def write_parquet(rows, output_dir, schema=SCHEMA_YOUTUBE_SEARCH_RESULTS, compression='snappy'):
+    """ Write rows to Parquet files under output_dir, one file per hour/data source partition.
+
+        Returns the list of files written. """
+    pa, pq = _import_pyarrow()
+
+    partitions = {}
+    for row in rows:
+        partitions.setdefault(partition_key(row), []).append(row)
+
+    dictionary_columns = [field['name'] for field in schema if field['name'] in DICTIONARY_COLUMNS]
+    file_suffix = "{}-{}".format(datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S'), uuid.uuid4().hex[:8])
+
+    files_written = []
+    for (hour, source), partition_rows in sorted(partitions.items()):
+        partition_dir = os.path.join(output_dir, "search_hour={}".format(hour),
+                                     "{}={}".format(PARTITION_SOURCE_COLUMN, quote(source, safe='')))
+        os.makedirs(partition_dir, exist_ok=True)
+
+        file_name = os.path.join(partition_dir, "part-{}.parquet".format(file_suffix))
+        table = pa.Table.from_batches([rows_to_record_batch(partition_rows, schema)])
+        pq.write_table(table, file_name, compression=compression, use_dictionary=dictionary_columns)
+        files_written.append(file_name)
+
+    return files_written
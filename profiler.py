@@ -0,0 +1,167 @@
+""" Built-in stage profiler for production runs.
+
+    Pipeline stages (API calls, response parsing, scrub_serializable, BigQuery inserts, backup writes...)
+    are wrapped in `with stage('name'):` blocks. When profiling is off these cost one attribute lookup;
+    when it is on, each block adds two perf_counter calls and a lock, cheap enough to leave on.
+
+    Optionally, cProfile and tracemalloc can be turned on for a bounded sampling window at the start of a
+    run. The window is closed at the first stage boundary after it ends, on the thread that started
+    profiling (cProfile only sees that thread).
+
+    The per-stage breakdown and top allocation sites are included in the run summary, and written to a
+    JSON profile file. cProfile statistics are written next to it, with a .prof extension, for use with
+    pstats or snakeviz.
+"""
+
+import cProfile
+import datetime
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+# Number of allocation sites to report
+TOP_ALLOCATIONS = 15
+
+
+class _NullStage(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage(object):
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.profiler.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class StageProfiler(object):
+    def __init__(self):
+        self.enabled = False
+        self._stages = {}  # name -> [count, total seconds, max seconds]
+        self._lock = threading.Lock()
+        self._started = None
+
+        self._sampling_until = None
+        self._sampling_thread = None
+        self._cprofile = None
+        self._allocations = []
+
+    def start(self, sampling_seconds=0, tracemalloc_frames=1):
+        """ Start timing stages. With sampling_seconds, also run cProfile and tracemalloc for that long. """
+        self.enabled = True
+        self._started = time.perf_counter()
+
+        if sampling_seconds:
+            self._sampling_until = time.monotonic() + sampling_seconds
+            self._sampling_thread = threading.get_ident()
+            tracemalloc.start(tracemalloc_frames)
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    def stage(self, name):
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def record(self, name, seconds):
+        with self._lock:
+            stats = self._stages.get(name)
+            if stats is None:
+                self._stages[name] = [1, seconds, seconds]
+            else:
+                stats[0] += 1
+                stats[1] += seconds
+                if seconds > stats[2]:
+                    stats[2] = seconds
+
+        if self._sampling_until is not None and time.monotonic() >= self._sampling_until:
+            self.stop_sampling()
+
+    def stop_sampling(self):
+        """ End the cProfile/tracemalloc window. Only the thread that started it can stop cProfile. """
+        if self._sampling_until is None or threading.get_ident() != self._sampling_thread:
+            return
+
+        self._sampling_until = None
+        self._cprofile.disable()
+
+        if tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            self._allocations = [
+                {'site': "{}:{}".format(stat.traceback[0].filename, stat.traceback[0].lineno),
+                 'size_kb': stat.size / 1024, 'count': stat.count}
+                for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]]
+
+    def get_stages(self):
+        """ Return per-stage statistics, slowest total first """
+        with self._lock:
+            stages = {name: list(stats) for name, stats in self._stages.items()}
+
+        elapsed = time.perf_counter() - self._started if self._started else 0
+        return [{'stage': name, 'count': count, 'total_seconds': total, 'mean_seconds': total / count,
+                 'max_seconds': maximum, 'share_of_run': total / elapsed if elapsed else None}
+                for name, (count, total, maximum) in sorted(stages.items(), key=lambda item: -item[1][1])]
+
+    def get_summary(self):
+        """ Return a human readable per-stage breakdown and top allocation sites for the run summary """
+        if not self.enabled:
+            return ""
+        self.stop_sampling()
+
+        message_body = "{:<24} {:>8} {:>10} {:>10} {:>10} {:>7}\n".format(
+            "stage", "count", "total s", "mean ms", "max ms", "share")
+        for stats in self.get_stages():
+            message_body += "{:<24} {:>8} {:>10.2f} {:>10.2f} {:>10.2f} {:>6.1f}%\n".format(
+                stats['stage'], stats['count'], stats['total_seconds'], stats['mean_seconds'] * 1000,
+                stats['max_seconds'] * 1000, (stats['share_of_run'] or 0) * 100)
+
+        if self._allocations:
+            message_body += "\nTop allocation sites:\n"
+            for allocation in self._allocations:
+                message_body += "{size_kb:>10.1f} KiB {count:>8} blocks  {site}\n".format(**allocation)
+        return message_body
+
+    def write(self, file_name):
+        """ Write the profile to file_name (JSON), and cProfile statistics, if any, to a .prof file beside it """
+        self.stop_sampling()
+
+        dir_name = os.path.dirname(file_name)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+
+        profile = {
+            'written': datetime.datetime.utcnow().isoformat("T") + "Z",
+            'elapsed_seconds': time.perf_counter() - self._started if self._started else 0,
+            'stages': self.get_stages(),
+            'top_allocations': self._allocations,
+        }
+        with open(file_name, 'w', encoding='utf-8') as f:
+            json.dump(profile, f, indent=2)
+
+        if self._cprofile is not None and self._sampling_until is None:
+            self._cprofile.dump_stats(os.path.splitext(file_name)[0] + '.prof')
+
+
+PROFILER = StageProfiler()
+
+
+def stage(name):
+    """ Time the wrapped block as a pipeline stage, if profiling is on """
+    return PROFILER.stage(name)
@@ -0,0 +1,172 @@
+""" Rank snapshot diffing: store only what changed between runs of the same search.
+
+    For top-rated and all-time searches, consecutive runs of a keyword mostly return the same videos in
+    the same order. For each keyword and search type, the ordered list of videoIds from the last run is
+    kept in a JSON state file. Each run is compared to it, and only the differences are emitted:
+
+        entered     a video that was not in the last snapshot (its result row is saved too)
+        left        a video from the last snapshot that is no longer returned
+        moved       a video that changed places relative to the other videos that stayed
+
+    Videos pushed down or up only by videos entering or leaving are not 'moved': the videos that stayed
+    keep their previous relative order, in the ranks not taken by entered and moved videos. 'moved' is
+    emitted for the fewest videos that explain the new order (those outside the longest run of videos
+    still in their previous relative order).
+
+    A keyword's full list is emitted instead (change 'snapshot', with all result rows) every
+    full_snapshot_every runs, when its last full snapshot is max_snapshot_age_days old, and whenever the
+    diff would have as many rows as the list. So the stored data can always be rebuilt from the latest
+    full snapshot plus the diffs after it, as long as max_snapshot_age_days is shorter than the table's
+    expiry (14 days, see README).
+
+    Keywords that returned no results are left out: search_youtube returns an empty list on API errors,
+    and treating that as every video leaving would be wrong.
+"""
+
+import bisect
+import datetime
+import json
+import os
+
+RANK_CHANGES_DATA_SOURCE = 'YouTube search rank changes'
+
+# Result tables expire after 14 days, so a full snapshot must be saved more often than that
+MAX_SNAPSHOT_AGE_DAYS = 13
+
+
+def _as_utc(value):
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        return value.replace(tzinfo=datetime.timezone.utc)
+    return value.astimezone(datetime.timezone.utc)
+
+
+def _in_previous_order(video_ids, previous_ranks):
+    """ Return the largest set of video_ids (all in previous_ranks) that are still in their previous
+        relative order: the longest increasing subsequence of their previous ranks. """
+    tails = []  # tails[i]: index into video_ids of the smallest last rank of an increasing run of length i+1
+    tail_ranks = []
+    parents = [None] * len(video_ids)
+    for index, video_id in enumerate(video_ids):
+        rank = previous_ranks[video_id]
+        position = bisect.bisect_left(tail_ranks, rank)
+        parents[index] = tails[position - 1] if position else None
+        if position == len(tails):
+            tails.append(index)
+            tail_ranks.append(rank)
+        else:
+            tails[position] = index
+            tail_ranks[position] = rank
+
+    in_order = set()
+    index = tails[-1] if tails else None
+    while index is not None:
+        in_order.add(video_ids[index])
+        index = parents[index]
+    return in_order
+
+
+class RankSnapshotStore(object):
+    def __init__(self, state_file, full_snapshot_every=24, max_snapshot_age_days=MAX_SNAPSHOT_AGE_DAYS):
+        self.state_file = state_file
+        self.full_snapshot_every = full_snapshot_every
+        self.max_snapshot_age = datetime.timedelta(days=max_snapshot_age_days)
+        self.snapshots = {}  # key -> {'video_ids': [...], 'runs_since_full': n, 'full_snapshot_time': iso time}
+
+        self.load()
+
+    @staticmethod
+    def key(keyword, study_group, search_type):
+        return "{}\t{}\t{}".format(search_type, study_group, keyword)
+
+    def load(self):
+        if not self.state_file or not os.path.exists(self.state_file):
+            return
+
+        with open(self.state_file, 'r', encoding='utf-8') as f:
+            self.snapshots = json.load(f)
+
+    def save(self):
+        dir_name = os.path.dirname(self.state_file)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+
+        # Write to a temporary file first, so a crash never leaves a half written state file
+        tmp_file = self.state_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshots, f)
+        os.replace(tmp_file, self.state_file)
+
+    def diff(self, results, search_type):
+        """ Compare results (in the order returned by the API) to the last snapshot of each keyword.
+
+            Returns (result_rows, rank_rows): the result rows to save (new entries, or every row for a
+            full snapshot) and the rank change rows. Snapshots are updated; call save() once the rows
+            have been saved. """
+
+        groups = {}
+        for row in results:
+            groups.setdefault((row['search_term'], row['study_group']), []).append(row)
+
+        result_rows = []
+        rank_rows = []
+        for (keyword, study_group), rows in groups.items():
+            key = self.key(keyword, study_group, search_type)
+            previous = self.snapshots.get(key)
+            video_ids = [row['videoId'] for row in rows]
+            search_time = rows[0]['search_time']
+
+            def rank_row(video_id, change, rank, previous_rank):
+                return {'search_term': keyword, 'search_type': search_type, 'study_group': study_group,
+                        'search_time': search_time, 'videoId': video_id, 'change': change, 'rank': rank,
+                        'previous_rank': previous_rank, 'observatory_data_source': RANK_CHANGES_DATA_SOURCE}
+
+            previous_ranks = {}
+            if previous:
+                previous_ranks = {video_id: rank for rank, video_id in enumerate(previous['video_ids'], start=1)}
+
+            def full_snapshot():
+                result_rows.extend(rows)
+                for rank, video_id in enumerate(video_ids, start=1):
+                    rank_rows.append(rank_row(video_id, 'snapshot', rank, previous_ranks.get(video_id)))
+                self.snapshots[key] = {'video_ids': video_ids, 'runs_since_full': 0,
+                                       'full_snapshot_time': _as_utc(search_time).isoformat()}
+
+            # Snapshots from before full_snapshot_time was kept have an unknown age
+            if previous is None or previous['runs_since_full'] + 1 >= self.full_snapshot_every or \
+                    'full_snapshot_time' not in previous or \
+                    _as_utc(search_time) - _as_utc(previous['full_snapshot_time']) >= self.max_snapshot_age:
+                full_snapshot()
+                continue
+
+            stayed = [video_id for video_id in video_ids if video_id in previous_ranks]
+            in_order = _in_previous_order(stayed, previous_ranks)
+
+            changed_result_rows = []
+            changed_rank_rows = []
+            current_ranks = {}
+            for rank, (video_id, row) in enumerate(zip(video_ids, rows), start=1):
+                current_ranks[video_id] = rank
+                previous_rank = previous_ranks.get(video_id)
+                if previous_rank is None:
+                    changed_result_rows.append(row)
+                    changed_rank_rows.append(rank_row(video_id, 'entered', rank, None))
+                elif video_id not in in_order:
+                    changed_rank_rows.append(rank_row(video_id, 'moved', rank, previous_rank))
+
+            for video_id, previous_rank in previous_ranks.items():
+                if video_id not in current_ranks:
+                    changed_rank_rows.append(rank_row(video_id, 'left', None, previous_rank))
+
+            # A diff as long as the list saves nothing over a full snapshot
+            if len(changed_rank_rows) >= len(video_ids):
+                full_snapshot()
+                continue
+
+            result_rows.extend(changed_result_rows)
+            rank_rows.extend(changed_rank_rows)
+            self.snapshots[key] = {'video_ids': video_ids, 'runs_since_full': previous['runs_since_full'] + 1,
+                                   'full_snapshot_time': previous['full_snapshot_time']}
+
+        return result_rows, rank_rows
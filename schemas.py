@@ -10,3 +10,15 @@ SCHEMA_YOUTUBE_SEARCH_RESULTS = [
     {"name": "search_time", "type": "TIMESTAMP", "mode": "nullable"},
     {"name": "study_group", "type": "STRING", "mode": "nullable"},
 ]
+
+SCHEMA_YOUTUBE_RANK_CHANGES = [
+    {"name": "search_term", "type": "STRING"},
+    {"name": "search_type", "type": "STRING"},
+    {"name": "study_group", "type": "STRING", "mode": "nullable"},
+    {"name": "search_time", "type": "TIMESTAMP", "mode": "nullable"},
+    {"name": "videoId", "type": "STRING", "mode": "nullable"},
+    {"name": "change", "type": "STRING", "mode": "nullable"},
+    {"name": "rank", "type": "INTEGER", "mode": "nullable"},
+    {"name": "previous_rank", "type": "INTEGER", "mode": "nullable"},
+    {"name": "observatory_data_source", "type": "STRING", "mode": "NULLABLE"},
+]
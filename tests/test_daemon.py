@@ -0,0 +1,117 @@
+import os
+import tempfile
+
+from nose.tools import assert_equal, assert_false, assert_raises, assert_true
+
+from youtube_daemon import ScheduledSearch, load_schedule, parse_interval
+
+
+class TestParseInterval(object):
+    def __init__(self):
+        pass
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def test_units(self):
+        assert_equal(parse_interval(90), 90)
+        assert_equal(parse_interval('90'), 90)
+        assert_equal(parse_interval('45s'), 45)
+        assert_equal(parse_interval('30m'), 1800)
+        assert_equal(parse_interval(' 1.5h '), 5400)
+        assert_equal(parse_interval('1d'), 86400)
+
+    def test_invalid(self):
+        assert_raises(ValueError, parse_interval, 'hourly')
+        assert_raises(ValueError, parse_interval, '1w')
+        assert_raises(ValueError, parse_interval, '0m')
+        assert_raises(ValueError, parse_interval, -5)
+
+
+class TestLoadSchedule(object):
+    def __init__(self):
+        pass
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        pass
+
+    def write_schedule(self, content):
+        file_name = os.path.join(self.tmp_dir, 'schedule.yml')
+        with open(file_name, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return file_name
+
+    def write_keywords(self, name):
+        file_name = os.path.join(self.tmp_dir, name)
+        with open(file_name, 'w', encoding='utf-8') as f:
+            f.write('keyword,study_group\nelection,tests\n')
+        return file_name
+
+    def test_searches_and_defaults(self):
+        keywords, a, b = (self.write_keywords(name) for name in ('keywords.csv', 'a.csv', 'b.csv'))
+        file_name = self.write_schedule('searches:\n'
+                                        '  - search_type: last-hour\n'
+                                        '    keywords: {}\n'
+                                        '  - name: daily\n'
+                                        '    search_type: today\n'
+                                        '    every: 6h\n'
+                                        '    keywords: [{}, {}]\n'
+                                        '    search_results: 50\n'
+                                        '    quota: 20000\n'
+                                        '    diff_ranks: true\n'
+                                        'sampler: true\n'.format(keywords, a, b))
+        schedule = load_schedule(file_name)
+        assert_true(schedule['sampler'])
+
+        hourly, daily = schedule['searches']
+        assert_equal(hourly.name, 'last-hour')
+        assert_equal(hourly.interval, 3600)
+        assert_equal(hourly.keyword_files, [keywords])
+        assert_equal(hourly.max_search_results, 20)
+        assert_equal(hourly.quota_units, 0)
+        assert_false(hourly.diff_ranks)
+        assert_equal(hourly.yield_state, 'data/keyword_yield_last-hour.json')
+
+        assert_equal(daily.name, 'daily')
+        assert_equal(daily.interval, 6 * 3600)
+        assert_equal(daily.keyword_files, [a, b])
+        assert_equal(daily.max_search_results, 50)
+        assert_equal(daily.quota_units, 20000)
+        assert_true(daily.diff_ranks)
+        assert_equal(daily.rank_state, 'data/rank_snapshots_daily.json')
+
+    def test_empty_schedule(self):
+        schedule = load_schedule(self.write_schedule(''))
+        assert_equal(schedule['searches'], [])
+        assert_false(schedule['sampler'])
+
+    def test_invalid_search_type(self):
+        file_name = self.write_schedule('searches:\n'
+                                        '  - search_type: yesterday\n'
+                                        '    keywords: keywords.csv\n')
+        assert_raises(ValueError, load_schedule, file_name)
+
+    def test_missing_keyword_file(self):
+        file_name = self.write_schedule('searches:\n'
+                                        '  - search_type: today\n'
+                                        '    keywords: [{}, missing.csv]\n'.format(self.write_keywords('a.csv')))
+        assert_raises(ValueError, load_schedule, file_name)
+
+    def test_bad_keyword_file_fails_before_searching(self):
+        bad_file = os.path.join(self.tmp_dir, 'bad.csv')
+        with open(bad_file, 'w', encoding='utf-8') as f:
+            f.write('term,group\nelection,tests\n')
+        job = ScheduledSearch('tests', 'today', 3600, [self.write_keywords('a.csv'), bad_file])
+        # No clients are needed: the bad file is found before any search
+        assert_raises(ValueError, job.run, None)
+
+    def test_missing_keywords(self):
+        file_name = self.write_schedule('searches:\n'
+                                        '  - search_type: today\n')
+        assert_raises(ValueError, load_schedule, file_name)
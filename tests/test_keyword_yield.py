@@ -0,0 +1,71 @@
+import os
+import tempfile
+
+from nose.tools import assert_equal, assert_in, assert_not_in, assert_true
+
+from keyword_yield import KeywordYieldScheduler
+
+
+class TestKeywordYield(object):
+    def __init__(self):
+        pass
+
+    def setUp(self):
+        self.state_file = os.path.join(tempfile.mkdtemp(), 'yield.json')
+        self.keywords = [{'keyword': 'k{}'.format(i), 'study_group': 'tests'} for i in range(10)]
+        self.next_video = 0
+
+    def tearDown(self):
+        pass
+
+    def search(self, scheduler, yields, quota_units=300):
+        selected = scheduler.select(self.keywords, 'today', quota_units)
+        results = []
+        for entry in selected:
+            for _ in range(yields.get(entry['keyword'], 0)):
+                self.next_video += 1
+                results.append({'videoId': str(self.next_video), 'search_term': entry['keyword'],
+                                'study_group': entry['study_group']})
+        scheduler.record(selected, results, 'today')
+        scheduler.save()
+        return [entry['keyword'] for entry in selected]
+
+    def test_budget_and_preference_for_high_yield(self):
+        yields = {'k0': 20, 'k1': 20}
+        for _ in range(5):
+            scheduler = KeywordYieldScheduler(self.state_file, max_skipped_runs=100)
+            selected = self.search(scheduler, yields)
+            assert_equal(len(selected), 3)
+
+        # Every keyword has been tried once; the high yield keywords are now always chosen
+        assert_in('k0', selected)
+        assert_in('k1', selected)
+
+    def test_minimum_revisit(self):
+        yields = {'k0': 20, 'k1': 20, 'k2': 20}
+        last_searched = {}
+        for run in range(20):
+            scheduler = KeywordYieldScheduler(self.state_file, max_skipped_runs=5)
+            for keyword in self.search(scheduler, yields):
+                last_searched[keyword] = run
+        # Low yield keywords are still searched at least once every few runs
+        for entry in self.keywords:
+            assert_in(entry['keyword'], last_searched)
+            assert_true(last_searched[entry['keyword']] >= 20 - 10)
+
+    def test_repeat_videos_are_not_new(self):
+        scheduler = KeywordYieldScheduler(self.state_file)
+        selected = scheduler.select(self.keywords[:1], 'today', 100)
+        row = {'videoId': 'abc', 'search_term': 'k0', 'study_group': 'tests'}
+        assert_equal(scheduler.record(selected, [row], 'today'), 1)
+        selected = scheduler.select(self.keywords[:1], 'today', 100)
+        assert_equal(scheduler.record(selected, [dict(row)], 'today'), 0)
+
+    def test_failed_calls_are_not_recorded(self):
+        scheduler = KeywordYieldScheduler(self.state_file)
+        selected = scheduler.select(self.keywords[:2], 'today', 200)
+        row = {'videoId': 'abc', 'search_term': 'k0', 'study_group': 'tests'}
+        assert_equal(scheduler.record(selected, [row], 'today', failed_keywords=[self.keywords[1]]), 1)
+
+        assert_equal(scheduler.keywords[scheduler.key(self.keywords[0], 'today')]['calls'], 1)
+        assert_not_in(scheduler.key(self.keywords[1], 'today'), scheduler.keywords)
@@ -0,0 +1,61 @@
+import json
+import os
+import tempfile
+
+from nose.tools import assert_equal, assert_raises
+
+from keywords import iter_keywords
+
+
+class TestKeywords(object):
+    def __init__(self):
+        pass
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        pass
+
+    def write_file(self, name, content):
+        file_name = os.path.join(self.tmp_dir, name)
+        with open(file_name, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return file_name
+
+    def test_csv_normalised_and_deduplicated(self):
+        file_name = self.write_file('keywords.csv',
+                                    'keyword,study_group,source\n'
+                                    '"  climate   change ",election,a\n'
+                                    'Climate Change,election,b\n'
+                                    ',election,c\n'
+                                    'climate change,other,d\n')
+        keywords = list(iter_keywords(file_name))
+        assert_equal(keywords, [{'keyword': 'climate change', 'study_group': 'election'},
+                                {'keyword': 'climate change', 'study_group': 'other'}])
+
+    def test_jsonl(self):
+        file_name = self.write_file('keywords.jsonl',
+                                    json.dumps({'keyword': 'canberra', 'study_group': 'tests'}) + '\n\n' +
+                                    json.dumps({'keyword': 'election', 'study_group': 'tests'}) + '\n')
+        assert_equal([k['keyword'] for k in iter_keywords(file_name)], ['canberra', 'election'])
+
+    def test_jsonl_bad_lines_are_skipped(self):
+        file_name = self.write_file('keywords.jsonl',
+                                    json.dumps({'keyword': 'canberra', 'study_group': 'tests'}) + '\n' +
+                                    '{"keyword": "trunc\n' +
+                                    '["not", "an", "object"]\n' +
+                                    json.dumps({'keyword': 'election', 'study_group': 'tests'}) + '\n')
+        assert_equal([k['keyword'] for k in iter_keywords(file_name)], ['canberra', 'election'])
+
+    def test_csv_with_byte_order_mark(self):
+        file_name = self.write_file('keywords.csv', '\ufeffkeyword,study_group\ncanberra,tests\n')
+        assert_equal(list(iter_keywords(file_name)), [{'keyword': 'canberra', 'study_group': 'tests'}])
+
+    def test_missing_columns_fail_immediately(self):
+        file_name = self.write_file('keywords.csv', 'keyword,source\ncanberra,a\n')
+        assert_raises(ValueError, iter_keywords, file_name)
+
+    def test_empty_file(self):
+        file_name = self.write_file('keywords.csv', 'keyword,study_group\n')
+        assert_equal(list(iter_keywords(file_name)), [])
@@ -0,0 +1,97 @@
+import time
+
+from nose.tools import assert_equal, assert_in, assert_not_equal, assert_true
+
+from log import AlertDispatcher, get_error_signature
+
+
+def raise_value_error(message):
+    raise ValueError(message)
+
+
+def raise_key_error(message):
+    raise KeyError(message)
+
+
+class TestAlertDispatcher(object):
+    def __init__(self):
+        pass
+
+    def setUp(self):
+        self.emails = []
+        self.dispatcher = AlertDispatcher(send_func=self.emails.append, min_seconds_between_emails=1,
+                                          dedup_seconds=3600)
+
+    def tearDown(self):
+        self.dispatcher.stop()
+
+    def wait_for_emails(self, count, timeout=5):
+        deadline = time.monotonic() + timeout
+        while len(self.emails) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self.emails
+
+    def test_first_alert_sent_immediately(self):
+        self.dispatcher.submit_alert('tests: ValueError at a.py:1', 'Problem A', 'Details of A')
+        emails = self.wait_for_emails(1, timeout=0.5)
+        assert_equal(len(emails), 1)
+        assert_equal(emails[0]['subject'], 'Problem A')
+        assert_true(emails[0]['text'].startswith('Details of A'))
+
+    def test_repeats_are_only_counted(self):
+        self.dispatcher.submit_alert('tests: ValueError at a.py:1', 'Problem A', 'Details of A')
+        self.wait_for_emails(1)
+        for _ in range(3):
+            self.dispatcher.submit_alert('tests: ValueError at a.py:1', 'Problem A', 'Details of A')
+
+        # Repeats alone are never emailed, even once the rate limit has passed
+        time.sleep(1.5)
+        self.dispatcher.stop()
+        assert_equal(len(self.emails), 1)
+
+    def test_digest_lists_suppressed_counts(self):
+        self.dispatcher.submit_alert('tests: ValueError at a.py:1', 'Problem A', 'Details of A')
+        self.wait_for_emails(1)
+
+        self.dispatcher.submit_alert('tests: ValueError at a.py:1', 'Problem A', 'Details of A')
+        self.dispatcher.submit_alert('tests: ValueError at a.py:1', 'Problem A', 'Details of A')
+        self.dispatcher.submit_alert('tests: KeyError at b.py:2', 'Problem B', 'Details of B')
+        self.dispatcher.submit_alert('tests: KeyError at b.py:2', 'Problem B', 'More details of B')
+        self.dispatcher.submit_alert('tests: TypeError at c.py:3', 'Problem C', 'Details of C')
+
+        emails = self.wait_for_emails(2)
+        assert_equal(len(emails), 2)
+        digest = emails[1]
+        assert_equal(digest['subject'], 'Error digest: 2 distinct errors, 3 occurrences')
+        assert_in('2 x Problem B\nDetails of B', digest['text'])
+        assert_in('1 x Problem C\nDetails of C', digest['text'])
+        assert_in('2 x tests: ValueError at a.py:1', digest['text'])
+
+
+class TestErrorSignature(object):
+    def __init__(self):
+        pass
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def get_signature(self, raise_func, message):
+        try:
+            raise_func(message)
+        except Exception:
+            return get_error_signature(module_name='tests', message=message)
+
+    def test_same_error_different_message(self):
+        signature = self.get_signature(raise_value_error, 'first')
+        assert_equal(signature, self.get_signature(raise_value_error, 'second'))
+        assert_true(signature.startswith('tests: ValueError at '))
+
+    def test_different_errors(self):
+        assert_not_equal(self.get_signature(raise_value_error, 'first'),
+                         self.get_signature(raise_key_error, 'first'))
+
+    def test_no_exception(self):
+        assert_equal(get_error_signature(module_name='tests', message='Problem'), 'tests: Problem')
@@ -0,0 +1,42 @@
+from nose.tools import assert_equal, assert_in, assert_raises, assert_true
+
+from metrics import MetricsRegistry
+
+
+class TestMetrics(object):
+    def __init__(self):
+        pass
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def tearDown(self):
+        pass
+
+    def test_counter_labels(self):
+        counter = self.registry.counter('test_total', "Test counter.")
+        counter.inc()
+        counter.inc(5, outcome='failed')
+        counter.inc(2, outcome='failed')
+        assert_equal(counter.get(), 1)
+        assert_equal(counter.get(outcome='failed'), 7)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = self.registry.histogram('test_seconds', "Test histogram.", buckets=(1, 10))
+        for value in (0.5, 5, 50):
+            histogram.observe(value)
+        text = self.registry.render_prometheus()
+        assert_in('test_seconds_bucket{le="1"} 1', text)
+        assert_in('test_seconds_bucket{le="10"} 2', text)
+        assert_in('test_seconds_bucket{le="+Inf"} 3', text)
+        assert_in('test_seconds_count 3', text)
+        assert_equal(histogram.get()['max'], 50)
+
+    def test_registry_reuses_and_checks_type(self):
+        gauge = self.registry.gauge('test_depth')
+        assert_true(self.registry.gauge('test_depth') is gauge)
+        assert_raises(ValueError, self.registry.counter, 'test_depth')
+
+    def test_summary(self):
+        self.registry.gauge('test_depth').set(3)
+        assert_in('test_depth: 3', self.registry.get_summary())
@@ -0,0 +1,90 @@
+import datetime
+import os
+import tempfile
+from unittest import SkipTest
+
+from nose.tools import assert_equal, assert_true
+
+from schemas import SCHEMA_YOUTUBE_RANK_CHANGES
+from parquet_sink import partition_key, rows_to_record_batch, write_parquet
+
+UTC = datetime.timezone.utc
+
+
+def make_row(video_id, search_time, source='YouTube random sample', search_term='election'):
+    return {'videoId': video_id, 'title': 'Title {}'.format(video_id), 'channelTitle': 'Channel',
+            'description': None, 'publishedAt': '2019-04-14T04:59:00+00:00', 'search_term': search_term,
+            'search_type': 'today', 'search_time': search_time, 'study_group': 'tests',
+            'observatory_data_source': source, 'not_in_schema': 'ignored'}
+
+
+class TestParquetSink(object):
+    def __init__(self):
+        pass
+
+    def setUp(self):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise SkipTest("pyarrow is not installed")
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        pass
+
+    def test_partition_key(self):
+        assert_equal(partition_key(make_row('a', datetime.datetime(2019, 4, 14, 5, 30))),
+                     ('2019041405', 'YouTube random sample'))
+        # tz-aware and ISO string times are partitioned by their UTC hour
+        aest = datetime.timezone(datetime.timedelta(hours=10))
+        assert_equal(partition_key(make_row('a', datetime.datetime(2019, 4, 14, 15, 30, tzinfo=aest)))[0],
+                     '2019041405')
+        assert_equal(partition_key(make_row('a', '2019-04-14T15:30:00+10:00'))[0], '2019041405')
+        assert_equal(partition_key({}), ('unknown', 'unknown'))
+
+    def test_record_batch_timestamps_and_dictionaries(self):
+        aest = datetime.timezone(datetime.timedelta(hours=10))
+        rows = [make_row('a', datetime.datetime(2019, 4, 14, 5, 30)),
+                make_row('b', datetime.datetime(2019, 4, 14, 15, 30, tzinfo=aest)),
+                make_row('c', '2019-04-14T05:30:00')]
+        batch = rows_to_record_batch(rows)
+
+        assert_true('not_in_schema' not in batch.schema.names)
+        for name in ('search_term', 'study_group', 'search_type', 'observatory_data_source'):
+            assert_true(self.pa.types.is_dictionary(batch.schema.field(name).type), name)
+
+        expected = datetime.datetime(2019, 4, 14, 5, 30, tzinfo=UTC)
+        assert_equal(batch.column(batch.schema.get_field_index('search_time')).to_pylist(), [expected] * 3)
+        assert_equal(batch.column(batch.schema.get_field_index('description')).to_pylist(), [None] * 3)
+
+    def test_write_and_read_back(self):
+        rows = [make_row('a', datetime.datetime(2019, 4, 14, 5, 10)),
+                make_row('b', datetime.datetime(2019, 4, 14, 5, 50), search_term='climate'),
+                make_row('c', datetime.datetime(2019, 4, 14, 6, 10)),
+                make_row('d', datetime.datetime(2019, 4, 14, 5, 20), source='YouTube search from keywords')]
+        files = write_parquet(rows, self.output_dir)
+
+        assert_equal(len(files), 3)
+        partitions = sorted(os.path.relpath(os.path.dirname(file_name), self.output_dir) for file_name in files)
+        assert_equal(partitions, [
+            os.path.join('search_hour=2019041405', 'observatory_data_source=YouTube%20random%20sample'),
+            os.path.join('search_hour=2019041405', 'observatory_data_source=YouTube%20search%20from%20keywords'),
+            os.path.join('search_hour=2019041406', 'observatory_data_source=YouTube%20random%20sample')])
+
+        table = self.pq.read_table(files[0])
+        assert_equal(table.column('videoId').to_pylist(), ['a', 'b'])
+        assert_equal(table.column('search_term').to_pylist(), ['election', 'climate'])
+        assert_true(self.pa.types.is_dictionary(table.schema.field('search_term').type))
+        assert_equal(table.column('search_time').to_pylist()[0], datetime.datetime(2019, 4, 14, 5, 10, tzinfo=UTC))
+
+    def test_rank_changes_schema(self):
+        rows = [{'search_term': 'election', 'search_type': 'top-rated', 'study_group': 'tests',
+                 'search_time': datetime.datetime(2019, 4, 14, 5, 30), 'videoId': 'a', 'change': 'moved',
+                 'rank': 2, 'previous_rank': 1, 'observatory_data_source': 'YouTube search rank changes'}]
+        files = write_parquet(rows, self.output_dir, schema=SCHEMA_YOUTUBE_RANK_CHANGES)
+        table = self.pq.read_table(files[0])
+        assert_equal(table.column('rank').to_pylist(), [2])
+        assert_equal(table.column('previous_rank').to_pylist(), [1])
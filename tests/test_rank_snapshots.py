@@ -0,0 +1,104 @@
+import datetime
+import os
+import random
+import tempfile
+
+from nose.tools import assert_equal, assert_true
+
+from rank_snapshots import RankSnapshotStore
+
+
+class TestRankSnapshots(object):
+    def __init__(self):
+        pass
+
+    def setUp(self):
+        self.state_file = os.path.join(tempfile.mkdtemp(), 'ranks.json')
+
+    def tearDown(self):
+        pass
+
+    def make_results(self, video_ids, keyword='canberra', search_time=None):
+        search_time = search_time or datetime.datetime.utcnow()
+        return [{'videoId': video_id, 'search_term': keyword, 'study_group': 'tests', 'search_time': search_time}
+                for video_id in video_ids]
+
+    def test_first_run_is_a_full_snapshot(self):
+        store = RankSnapshotStore(self.state_file)
+        result_rows, rank_rows = store.diff(self.make_results(['a', 'b', 'c']), 'top-rated')
+        assert_equal(len(result_rows), 3)
+        assert_equal([(r['videoId'], r['change'], r['rank']) for r in rank_rows],
+                     [('a', 'snapshot', 1), ('b', 'snapshot', 2), ('c', 'snapshot', 3)])
+
+    def test_diff(self):
+        store = RankSnapshotStore(self.state_file)
+        store.diff(self.make_results(['a', 'b', 'c', 'd', 'e']), 'top-rated')
+        store.save()
+
+        store = RankSnapshotStore(self.state_file)
+        result_rows, rank_rows = store.diff(self.make_results(['b', 'a', 'c', 'd', 'f']), 'top-rated')
+        assert_equal([r['videoId'] for r in result_rows], ['f'])
+        assert_equal(sorted((r['videoId'], r['change'], r['rank'], r['previous_rank']) for r in rank_rows),
+                     [('b', 'moved', 1, 2), ('e', 'left', None, 5), ('f', 'entered', 5, None)])
+
+    def test_entering_video_does_not_move_the_others(self):
+        store = RankSnapshotStore(self.state_file)
+        store.diff(self.make_results(['a', 'b', 'c', 'd', 'e']), 'top-rated')
+        result_rows, rank_rows = store.diff(self.make_results(['x', 'a', 'b', 'c', 'd']), 'top-rated')
+        assert_equal(sorted((r['videoId'], r['change']) for r in rank_rows), [('e', 'left'), ('x', 'entered')])
+
+    def test_diff_rebuilds_current_ranks(self):
+        rng = random.Random(7)
+        store = RankSnapshotStore(self.state_file, full_snapshot_every=1000)
+        previous = ['v{}'.format(i) for i in range(20)]
+        store.diff(self.make_results(previous), 'top-rated')
+        for run in range(200):
+            current = [video_id for video_id in previous if rng.random() > 0.1]
+            for _ in range(rng.randint(0, 3)):
+                current.insert(rng.randint(0, len(current)), 'new{}-{}'.format(run, rng.randint(0, 10 ** 6)))
+            for _ in range(rng.randint(0, 2)):
+                current.insert(rng.randint(0, len(current)), current.pop(rng.randrange(len(current))))
+
+            result_rows, rank_rows = store.diff(self.make_results(current), 'top-rated')
+            changes = {r['change'] for r in rank_rows}
+            if 'snapshot' in changes:
+                rebuilt = [r['videoId'] for r in sorted(rank_rows, key=lambda r: r['rank'])]
+            else:
+                # Entered and moved videos take their new ranks; the rest keep their previous order
+                placed = {r['rank']: r['videoId'] for r in rank_rows if r['change'] in ('entered', 'moved')}
+                removed = {r['videoId'] for r in rank_rows if r['change'] in ('left', 'moved')}
+                stayed = iter([video_id for video_id in previous if video_id not in removed])
+                rebuilt = [placed[rank] if rank in placed else next(stayed) for rank in range(1, len(current) + 1)]
+                assert_true(len(rank_rows) < len(current))
+            assert_equal(rebuilt, current)
+            previous = current
+
+    def test_large_diff_is_a_full_snapshot(self):
+        store = RankSnapshotStore(self.state_file)
+        store.diff(self.make_results(['a', 'b', 'c']), 'top-rated')
+        result_rows, rank_rows = store.diff(self.make_results(['d', 'e', 'a']), 'top-rated')
+        assert_equal(len(result_rows), 3)
+        assert_equal([(r['videoId'], r['change'], r['previous_rank']) for r in rank_rows],
+                     [('d', 'snapshot', None), ('e', 'snapshot', None), ('a', 'snapshot', 1)])
+
+    def test_full_snapshot_before_table_expiry(self):
+        store = RankSnapshotStore(self.state_file, full_snapshot_every=100, max_snapshot_age_days=13)
+        start = datetime.datetime(2019, 4, 1, 9)
+        for day in range(14):
+            result_rows, rank_rows = store.diff(
+                self.make_results(['a', 'b'], search_time=start + datetime.timedelta(days=day)), 'top-rated')
+            # Day 0 and day 13 are full snapshots
+            assert_equal(len(rank_rows), 2 if day in (0, 13) else 0)
+
+    def test_unchanged_results_emit_nothing(self):
+        store = RankSnapshotStore(self.state_file)
+        store.diff(self.make_results(['a', 'b']), 'all-time')
+        assert_equal(store.diff(self.make_results(['a', 'b']), 'all-time'), ([], []))
+
+    def test_periodic_full_snapshot(self):
+        store = RankSnapshotStore(self.state_file, full_snapshot_every=3)
+        # Runs 1 and 4 are full snapshots
+        for _ in range(4):
+            result_rows, rank_rows = store.diff(self.make_results(['a', 'b']), 'all-time')
+        assert_equal(len(result_rows), 2)
+        assert_equal([r['change'] for r in rank_rows], ['snapshot', 'snapshot'])
@@ -1,11 +1,13 @@
+import os
 import tempfile
 
-from nose.tools import assert_equal, assert_true
+from nose.tools import assert_equal, assert_false, assert_true
 
 from config import cfg
 from log import getLogger
 from utils import yt_get_client
-from youtube_sample import get_recent_youtube_vids
+from wal import WriteAheadLog
+from youtube_sample import get_recent_youtube_vids, save_videos
 
 logger = getLogger()
 
@@ -36,4 +38,24 @@ class TestYoutube(object):
         assert_true(len(results) >= 10, "At least ten results found.")
 
 
+class TestSaveVideos(object):
+    def __init__(self):
+        pass
+
+    def setUp(self):
+        self.wal = WriteAheadLog(os.path.join(tempfile.mkdtemp(), 'sample.wal'))
+        self.videos = [{'videoId': 'a'}, {'videoId': 'b'}]
+        self.wal.append(self.videos)
+
+    def tearDown(self):
+        self.wal.close()
+
+    def test_saved_videos_are_removed_from_wal(self):
+        saved = save_videos(self.wal, self.videos, bq_client=object(), save_func=lambda *args, **kwargs: True)
+        assert_true(saved)
+        assert_equal(WriteAheadLog(self.wal.file_name).recover(), [])
 
+    def test_failed_save_keeps_wal(self):
+        saved = save_videos(self.wal, self.videos, bq_client=object(), save_func=lambda *args, **kwargs: False)
+        assert_false(saved)
+        assert_equal(WriteAheadLog(self.wal.file_name).recover(), self.videos)
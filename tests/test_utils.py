@@ -0,0 +1,62 @@
+import datetime
+import json
+import os
+import tempfile
+
+from nose.tools import assert_equal, assert_false, assert_true
+
+from schemas import SCHEMA_YOUTUBE_SEARCH_RESULTS
+from utils import upload_rows
+
+
+class FailingBigQueryClient(object):
+    """ Finds the table, but rejects every insert """
+
+    def __init__(self, missing_table=False):
+        self.missing_table = missing_table
+        self.inserts = 0
+
+    def get_table(self, table_id):
+        if self.missing_table:
+            raise Exception("Not found: Table {}".format(table_id))
+        return table_id
+
+    def insert_rows(self, table, rows):
+        self.inserts += 1
+        return [{'index': 0, 'errors': [{'reason': 'invalid'}]}]
+
+
+class TestUploadRows(object):
+    def __init__(self):
+        pass
+
+    def setUp(self):
+        self.backup_file_name = os.path.join(tempfile.mkdtemp(), 'backup.json')
+        self.rows = [{'videoId': str(i), 'title': 'Video {}'.format(i), 'search_term': 'election',
+                      'search_time': datetime.datetime(2019, 4, 14, 5, 30)} for i in range(5)]
+
+    def tearDown(self):
+        pass
+
+    def read_backup(self, index):
+        with open('{}.{}'.format(self.backup_file_name, index), 'r', encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def test_failed_insert_is_backed_up(self):
+        client = FailingBigQueryClient()
+        saved = upload_rows(SCHEMA_YOUTUBE_SEARCH_RESULTS, self.rows, client, 'dataset', 'table',
+                            backup_file_name=self.backup_file_name, len_chunks=3)
+        assert_true(saved)
+        assert_equal(client.inserts, 2)
+        assert_equal([row['videoId'] for row in self.read_backup(0) + self.read_backup(1)],
+                     ['0', '1', '2', '3', '4'])
+
+    def test_missing_table_is_backed_up(self):
+        saved = upload_rows(SCHEMA_YOUTUBE_SEARCH_RESULTS, self.rows, FailingBigQueryClient(missing_table=True),
+                            'dataset', 'table', backup_file_name=self.backup_file_name)
+        assert_true(saved)
+        assert_equal(len(self.read_backup(0)), 5)
+
+    def test_failed_insert_without_backup(self):
+        saved = upload_rows(SCHEMA_YOUTUBE_SEARCH_RESULTS, self.rows, FailingBigQueryClient(), 'dataset', 'table')
+        assert_false(saved)
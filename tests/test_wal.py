@@ -0,0 +1,52 @@
+import datetime
+import os
+import tempfile
+
+from nose.tools import assert_equal
+
+from wal import WriteAheadLog
+
+
+class TestWriteAheadLog(object):
+    def __init__(self):
+        pass
+
+    def setUp(self):
+        self.file_name = os.path.join(tempfile.mkdtemp(), 'sample.wal')
+
+    def tearDown(self):
+        pass
+
+    def test_recover_after_restart(self):
+        wal = WriteAheadLog(self.file_name, fsync_every_rows=1000)
+        search_time = datetime.datetime(2019, 4, 14, 5, 30)
+        wal.append([{'videoId': 'a', 'search_time': search_time}, {'videoId': 'b', 'search_term': None}])
+        wal.append([{'videoId': 'c'}])
+
+        # No close() - as if the process was killed
+        rows = WriteAheadLog(self.file_name).recover()
+        assert_equal([row['videoId'] for row in rows], ['a', 'b', 'c'])
+        assert_equal(rows[0]['search_time'], search_time.isoformat())
+
+    def test_truncate(self):
+        wal = WriteAheadLog(self.file_name)
+        wal.append([{'videoId': 'a'}])
+        wal.truncate()
+        wal.append([{'videoId': 'b'}])
+        wal.close()
+        assert_equal(WriteAheadLog(self.file_name).recover(), [{'videoId': 'b'}])
+
+    def test_partial_last_line_is_skipped(self):
+        wal = WriteAheadLog(self.file_name)
+        wal.append([{'videoId': 'a'}])
+        wal.close()
+        with open(self.file_name, 'a', encoding='utf-8') as f:
+            f.write('{"videoId": "b", "tit')
+        assert_equal(WriteAheadLog(self.file_name).recover(), [{'videoId': 'a'}])
+
+        wal = WriteAheadLog(self.file_name)
+        wal.append([{'videoId': 'c'}])
+        assert_equal(wal.recover(), [{'videoId': 'a'}, {'videoId': 'c'}])
+
+    def test_missing_file(self):
+        assert_equal(WriteAheadLog(self.file_name).recover(), [])
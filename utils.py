@@ -8,6 +8,9 @@ from google.cloud import bigquery
 from google.cloud import bigquery_storage_v1beta1
 import google.auth
 
+from metrics import ROWS_SPOOLED, ROWS_UPLOADED, UPLOAD_CHUNK_SECONDS
+from profiler import stage
+
 YOUTUBE_API_SERVICE_NAME = "youtube"
 YOUTUBE_API_VERSION = "v3"
 
@@ -63,15 +66,18 @@ def check_create_table(bq_client, schema, bq_dataset, bq_table, partition_by_day
 
 def upload_rows(schema, rows, bq_client, bq_dataset, bq_table,
                 backup_file_name=None, len_chunks=500):
-    """ Upload results to Google Bigquery """
+    """ Upload results to Google Bigquery.
+
+    Returns True if every chunk was either inserted or written to a backup file for later upload. """
 
     logger = logging.getLogger()
 
-    inserted = False
+    saved = True
     bq_rows = rows
 
     # Make sure objects are serializable. So far, special handling for Numpy types and dates:
-    bq_rows = scrub_serializable(bq_rows)
+    with stage('scrub_serializable'):
+        bq_rows = scrub_serializable(bq_rows)
 
     table = None
     try:
@@ -79,7 +85,7 @@ def upload_rows(schema, rows, bq_client, bq_dataset, bq_table,
     except Exception as e:
         logger.error(
             msg=f"Unable to save rows. Table {bq_dataset}.{bq_table} does not exist or there was some other "
-                         f"problem getting the table.", subject="Error inserting rows to Google Bigquery!")
+                         f"problem getting the table.", extra={'subject': "Error inserting rows to Google Bigquery!"})
 
     # google recommends chunks of ~500 rows
     for index, chunk in enumerate(chunks(bq_rows, len_chunks)):
@@ -91,9 +97,11 @@ def upload_rows(schema, rows, bq_client, bq_dataset, bq_table,
                     "Inserting {} rows to BigQuery table {}.{}, attempt {}.".format(len(chunk), bq_dataset,
                                                                                                 bq_table, index))
 
-                errors = bq_client.insert_rows(table, chunk)
+                with UPLOAD_CHUNK_SECONDS.time(), stage('bigquery_insert'):
+                    errors = bq_client.insert_rows(table, chunk)
                 if errors == []:
                     inserted = True
+                    ROWS_UPLOADED.inc(len(chunk), outcome='inserted')
 
                     logger.info("Successfully inserted {} rows to BigQuery table {}.{}, attempt {}.".format(len(chunk), bq_dataset, bq_table, index))
                 else:
@@ -105,6 +113,8 @@ def upload_rows(schema, rows, bq_client, bq_dataset, bq_table,
             str_error += "Could not get table, so could not push rows.\n\n"
 
         if not inserted:
+            ROWS_UPLOADED.inc(len(chunk), outcome='failed')
+            backed_up = False
             if backup_file_name:
                 save_file_full = '{}.{}'.format(backup_file_name, index)
                 logger.error("Failed to upload rows! Saving {} rows to newline delimited JSON file ({}) for later upload.".format(len(rows), save_file_full))
@@ -115,9 +125,12 @@ def upload_rows(schema, rows, bq_client, bq_dataset, bq_table,
                     pass  # We get here if we are saving to a file within the cwd without a full path
 
                 try:
-                    df = pd.DataFrame.from_dict(chunk)
-                    df = nan_ints(df, convert_strings=True)
-                    df.to_json(save_file_full, orient="records", lines=True, force_ascii=False)
+                    with stage('backup_write'):
+                        df = pd.DataFrame.from_dict(chunk)
+                        df = nan_ints(df, convert_strings=True)
+                        df.to_json(save_file_full, orient="records", lines=True, force_ascii=False)
+                    ROWS_SPOOLED.inc(len(chunk))
+                    backed_up = True
                     str_error += "Saved {} rows to newline delimited JSON file ({}) for later upload.\n\n".format(len(rows), save_file_full)
                 except Exception as e:
                     str_error += "Unable to save backup file {}: {}\n\n".format(save_file_full,  str(e)[:200])
@@ -130,11 +143,50 @@ def upload_rows(schema, rows, bq_client, bq_dataset, bq_table,
             message_body += str_error
 
             logger.error(
-                msg=message_body, subject=f"Error inserting rows to Google Bigquery! Table: {bq_dataset}.{bq_table}")
+                msg=message_body, extra={'subject': f"Error inserting rows to Google Bigquery! Table: {bq_dataset}.{bq_table}"})
             logger.debug("First three rows:")
             logger.debug(bq_rows[:3])
 
-    return inserted
+            saved = saved and backed_up
+
+    return saved
+
+
+def save_rows(schema, rows, bq_client, bq_dataset, bq_table, backup_file_name=None, sinks=('bigquery',),
+              parquet_dir=None):
+    """ Save results to each of the configured sinks: 'bigquery' (upload_rows) and/or 'parquet' (local files) """
+
+    logger = logging.getLogger()
+    saved = True
+
+    unknown_sinks = [sink for sink in sinks if sink not in ('bigquery', 'parquet')]
+    if unknown_sinks:
+        raise ValueError("Unknown output sink(s): {}. Use bigquery and/or parquet.".format(", ".join(unknown_sinks)))
+
+    # Write parquet first: upload_rows modifies rows in place to make them serializable
+    if 'parquet' in sinks:
+        from parquet_sink import write_parquet
+        parquet_dir = parquet_dir or 'data/parquet'
+        try:
+            with stage('parquet_write'):
+                files = write_parquet(rows, parquet_dir, schema=schema)
+            logger.info("Saved {} rows to {} parquet file(s) in {}.".format(len(rows), len(files), parquet_dir))
+        except Exception as e:
+            saved = False
+            logger.error("Unable to save {} rows to parquet in {}: {}".format(len(rows), parquet_dir, e))
+
+    if 'bigquery' in sinks:
+        saved = upload_rows(schema, rows, bq_client, bq_dataset, bq_table, backup_file_name=backup_file_name) and saved
+
+    return saved
+
+
+def get_output_sinks(cfg):
+    """ Read the list of output sinks from config, defaulting to BigQuery only """
+    sinks = cfg.get('OUTPUT_SINKS') or ['bigquery']
+    if isinstance(sinks, str):
+        sinks = [sink.strip() for sink in sinks.split(',')]
+    return sinks
 
 
 def nan_ints(df,convert_strings=False,subset = None):
@@ -0,0 +1,106 @@
+""" A simple write-ahead log for rows that have been collected but not yet saved.
+
+    Rows are appended to a newline delimited JSON file as they arrive and the file is flushed after every
+    append, so they survive the process being killed. fsync, which also protects against the machine
+    losing power, is batched: it runs once fsync_every_rows rows or fsync_every_seconds seconds have been
+    appended since the last one.
+
+    On restart, recover() returns the rows in the log. Once they have been saved elsewhere, truncate()
+    empties it. A crash between saving and truncating means the rows are saved again on restart, so
+    delivery is at least once.
+
+    Datetimes are written in ISO format and recovered as strings, which upload_rows and the parquet sink
+    both accept.
+"""
+
+import datetime
+import json
+import logging
+import os
+import time
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if hasattr(value, 'dtype'):
+        return value.item()
+    raise TypeError("Object of type {} is not JSON serializable".format(type(value).__name__))
+
+
+class WriteAheadLog(object):
+    def __init__(self, file_name, fsync_every_rows=500, fsync_every_seconds=60):
+        self.file_name = file_name
+        self.fsync_every_rows = fsync_every_rows
+        self.fsync_every_seconds = fsync_every_seconds
+
+        self._file = None
+        self._rows_since_sync = 0
+        self._last_sync = time.monotonic()
+
+    def recover(self):
+        """ Return the rows in the log. A partly written last line (from a crash mid-write) is skipped. """
+        rows = []
+        if not os.path.exists(self.file_name):
+            return rows
+
+        with open(self.file_name, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    logging.getLogger().warning("Skipping unreadable line {} in write-ahead log {}.".format(
+                        line_number, self.file_name))
+        return rows
+
+    def _open(self):
+        if self._file is None:
+            dir_name = os.path.dirname(self.file_name)
+            if dir_name:
+                os.makedirs(dir_name, exist_ok=True)
+            self._file = open(self.file_name, 'a', encoding='utf-8')
+
+            # Start on a new line if a crash left a partly written row at the end
+            if self._file.tell() > 0:
+                with open(self.file_name, 'rb') as f:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        self._file.write("\n")
+        return self._file
+
+    def append(self, rows):
+        if not rows:
+            return
+
+        f = self._open()
+        f.write("".join(json.dumps(row, default=_json_default, ensure_ascii=False) + "\n" for row in rows))
+        f.flush()
+
+        self._rows_since_sync += len(rows)
+        if self._rows_since_sync >= self.fsync_every_rows or \
+                time.monotonic() - self._last_sync >= self.fsync_every_seconds:
+            self.sync()
+
+    def sync(self):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._rows_since_sync = 0
+        self._last_sync = time.monotonic()
+
+    def truncate(self):
+        """ Empty the log, once its rows have been saved """
+        f = self._open()
+        f.truncate(0)
+        f.flush()
+        os.fsync(f.fileno())
+        self._rows_since_sync = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
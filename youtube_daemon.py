@@ -0,0 +1,253 @@
+""" Long-running service that runs scheduled keyword searches and the random sampler in one process.
+
+    Running youtube_search.py from cron pays for imports, config parsing and API/BigQuery client setup on
+    every run. This service starts once, keeps the clients warm, and runs each search on its schedule.
+
+Process:
+    Scheduled searches run one at a time on a single scheduler thread, so a search that runs long never
+    overlaps with the next one (or with itself). A search that misses its slot runs once, as soon as the
+    scheduler is free; slots missed while it waited are skipped rather than run back to back.
+    If enabled, the random sampler (youtube_sample.py) runs on its own thread with its own YouTube client.
+
+Input:
+    A YAML schedule file, for example:
+
+        searches:
+          - search_type: last-hour
+            every: 1h
+            keywords: [keywords_aus_politics.csv]
+          - search_type: today
+            every: 6h
+            keywords: [keywords_aus_politics.csv, more_keywords.jsonl]
+            search_results: 50
+            quota: 20000
+          - search_type: top-rated
+            every: 1d
+            keywords: [keywords_aus_politics.csv]
+            diff_ranks: true
+        sampler: true
+
+    'every' is a number of seconds, or a number followed by s, m, h or d. With 'quota', each run spends at
+    most that many quota units, on the keywords with the best history of finding new videos (see
+    keyword_yield.py); 'yield_state' sets where that history is kept. With 'diff_ranks', only changes in
+    each keyword's ranked results are saved (see rank_snapshots.py), with a full snapshot every
+    'full_snapshot_every' runs (default 24) and at least every 13 days, before the tables expire;
+    'rank_state' sets where the last snapshots are kept.
+
+Output:
+    As for youtube_search.py and youtube_sample.py.
+"""
+
+import datetime
+import os
+import re
+import signal
+import threading
+import time
+from itertools import chain
+
+from docopt import docopt
+from yaml import safe_load
+
+import youtube_sample
+from config import cfg
+from keyword_yield import KeywordYieldScheduler
+from log import CountsHandler, getLogger, print_run_summary, send_exception
+from metrics import start_metrics_server
+from rank_snapshots import RankSnapshotStore
+from utils import bq_get_clients, get_output_sinks, yt_get_client
+from youtube_search import SEARCH_TYPES, get_keywords, search_youtube_keywords, setup_logging
+
+MODULE_FRIENDLY_IDENTIFIER = "YouTube Search Service"
+
+# Rebuild the YouTube client after this long, as youtube_sample does
+SECONDS_BETWEEN_CLIENT_REFRESH = 3600
+
+_INTERVAL_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def main():
+    """ Run scheduled YouTube searches and the random sampler as a long-running service
+
+    Usage:
+      youtube_daemon.py [-v] [-l log_file] <schedule_file>
+
+    Options:
+      -h --help                 Show this screen.
+      -v --verbose              Increase verbosity for debugging.
+      -l <log_file> --log=<log_file>    Save log to file
+
+      --version  Show version.
+
+    """
+
+    args = docopt(main.__doc__, version='YouTube Search Service 0.1')
+
+    # Everything, including the sampler's logger, goes through the root logger's handlers
+    setup_logging(log_file_name=args['--log'], verbose=args['--verbose'])
+    getLogger().addHandler(CountsHandler())
+
+    if cfg.get('METRICS_PORT'):
+        start_metrics_server(cfg['METRICS_PORT'])
+
+    schedule = load_schedule(args['<schedule_file>'])
+
+    stop_event = threading.Event()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signal_number, lambda signum, frame: stop_event.set())
+
+    run_service(schedule, stop_event)
+
+
+def parse_interval(value):
+    """ Convert 3600, '3600', '60m', '1h' or '1d' to a number of seconds """
+    if isinstance(value, (int, float)):
+        seconds = value
+    else:
+        match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([smhd]?)\s*', str(value))
+        if not match:
+            raise ValueError("Invalid interval '{}'. Use seconds, or a number followed by s, m, h or d.".format(value))
+        seconds = float(match.group(1)) * _INTERVAL_UNITS.get(match.group(2) or 's')
+
+    if seconds <= 0:
+        raise ValueError("Interval must be positive: '{}'".format(value))
+    return seconds
+
+
+def load_schedule(file_name):
+    with open(file_name, 'r') as f:
+        schedule = safe_load(f) or {}
+
+    jobs = []
+    for entry in schedule.get('searches') or []:
+        search_type = entry.get('search_type')
+        if search_type not in SEARCH_TYPES:
+            raise ValueError("Invalid search_type '{}' in {}. Use one of: {}".format(
+                search_type, file_name, ", ".join(SEARCH_TYPES)))
+
+        keyword_files = entry.get('keywords')
+        if isinstance(keyword_files, str):
+            keyword_files = [keyword_files]
+        if not keyword_files:
+            raise ValueError("Search '{}' in {} has no keyword files.".format(search_type, file_name))
+        missing_files = [keyword_file for keyword_file in keyword_files if not os.path.isfile(keyword_file)]
+        if missing_files:
+            raise ValueError("Keyword file(s) for search '{}' in {} not found: {}".format(
+                search_type, file_name, ", ".join(missing_files)))
+
+        jobs.append(ScheduledSearch(name=entry.get('name') or search_type,
+                                    search_type=search_type,
+                                    interval=parse_interval(entry.get('every', '1h')),
+                                    keyword_files=keyword_files,
+                                    max_search_results=int(entry.get('search_results', 20)),
+                                    quota_units=int(entry.get('quota') or 0),
+                                    yield_state=entry.get('yield_state'),
+                                    diff_ranks=bool(entry.get('diff_ranks', False)),
+                                    rank_state=entry.get('rank_state'),
+                                    full_snapshot_every=int(entry.get('full_snapshot_every', 24))))
+
+    return {'searches': jobs, 'sampler': bool(schedule.get('sampler', False))}
+
+
+class ScheduledSearch(object):
+    def __init__(self, name, search_type, interval, keyword_files, max_search_results=20, quota_units=0,
+                 yield_state=None, diff_ranks=False, rank_state=None, full_snapshot_every=24):
+        self.name = name
+        self.search_type = search_type
+        self.interval = interval
+        self.keyword_files = keyword_files
+        self.max_search_results = max_search_results
+        self.quota_units = quota_units
+        self.yield_state = yield_state or "data/keyword_yield_{}.json".format(name)
+        self.diff_ranks = diff_ranks
+        self.rank_state = rank_state or "data/rank_snapshots_{}.json".format(name)
+        self.full_snapshot_every = full_snapshot_every
+        self.next_run = time.monotonic()
+
+    def run(self, clients):
+        yield_scheduler = None
+        # Open and check every keyword file before searching, so a bad file can't fail the run part way through
+        keywords = chain.from_iterable([get_keywords(keyword_file) for keyword_file in self.keyword_files])
+        if self.quota_units:
+            yield_scheduler = KeywordYieldScheduler(self.yield_state)
+        rank_store = None
+        if self.diff_ranks:
+            rank_store = RankSnapshotStore(self.rank_state, full_snapshot_every=self.full_snapshot_every)
+
+        getLogger().info("Running scheduled search '{}' ({}) over {}.".format(
+            self.name, self.search_type, ", ".join(self.keyword_files)))
+        search_youtube_keywords(keywords, self.max_search_results, self.search_type,
+                                youtube_client=clients.youtube(), bq_client=clients.bigquery(),
+                                yield_scheduler=yield_scheduler, quota_units=self.quota_units,
+                                rank_store=rank_store)
+
+
+class WarmClients(object):
+    """ Keeps a YouTube client and a BigQuery client for reuse across runs.
+
+        The YouTube client is not thread safe, so each thread should have its own WarmClients. The
+        BigQuery client is only created if BigQuery is one of the output sinks. """
+
+    def __init__(self, bq_client=None):
+        self._youtube = None
+        self._youtube_created = None
+        self._bq_client = bq_client
+
+    def youtube(self):
+        if not self._youtube or time.monotonic() - self._youtube_created > SECONDS_BETWEEN_CLIENT_REFRESH:
+            self._youtube = yt_get_client(cfg['DEVELOPER_KEY'])
+            self._youtube_created = time.monotonic()
+        return self._youtube
+
+    def bigquery(self):
+        if not self._bq_client and 'bigquery' in get_output_sinks(cfg):
+            self._bq_client, bq_storage_client = bq_get_clients(project_id=cfg['PROJECT_ID'],
+                                                                json_key_file=cfg['BQ_KEY_FILE'])
+        return self._bq_client
+
+
+def run_service(schedule, stop_event):
+    logger = getLogger()
+    clients = WarmClients()
+
+    sampler_thread = None
+    if schedule['sampler']:
+        sampler_thread = threading.Thread(target=youtube_sample.run_sampler, name='RandomSampler',
+                                          kwargs={'stop_event': stop_event, 'bq_client': clients.bigquery()})
+        sampler_thread.start()
+
+    jobs = schedule['searches']
+    logger.info("Started {} with {} scheduled searches{}.".format(
+        MODULE_FRIENDLY_IDENTIFIER, len(jobs), " and the random sampler" if sampler_thread else ""))
+
+    while not stop_event.is_set():
+        if not jobs:
+            stop_event.wait()
+            break
+
+        job = min(jobs, key=lambda j: j.next_run)
+        wait_seconds = job.next_run - time.monotonic()
+        if wait_seconds > 0:
+            stop_event.wait(wait_seconds)
+            continue
+
+        start_time = datetime.datetime.utcnow()
+        try:
+            job.run(clients)
+        except Exception as e:
+            send_exception(module_name=MODULE_FRIENDLY_IDENTIFIER, message="Problem running scheduled search",
+                           message_body="Problem running scheduled search '{}': {}".format(job.name, e))
+
+        # Skip any slots missed while this or another search overran
+        while job.next_run <= time.monotonic():
+            job.next_run += job.interval
+        logger.info("Scheduled search '{}' finished in {}.".format(job.name, datetime.datetime.utcnow() - start_time))
+        print_run_summary("{} search '{}'".format(MODULE_FRIENDLY_IDENTIFIER, job.name))
+
+    logger.info("Stopping {}.".format(MODULE_FRIENDLY_IDENTIFIER))
+    if sampler_thread:
+        sampler_thread.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -21,17 +21,22 @@
 """
 
 import datetime
-import time
+import signal
+import threading
 
 import pytz
+from docopt import docopt
 
-from utils import bq_get_clients, yt_get_client, upload_rows
-from log import setup_logging, print_run_summary, send_exception
+from utils import bq_get_clients, get_output_sinks, save_rows, yt_get_client
+from log import getLogger, setup_logging, print_run_summary, send_exception
 from schemas import SCHEMA_YOUTUBE_SEARCH_RESULTS
 from config import cfg
+from metrics import QUEUE_DEPTH, SATURATED_WINDOWS, WINDOW_SATURATION, start_metrics_server
+from profiler import PROFILER, stage
+from wal import WriteAheadLog
 from youtube_utils import search_youtube
 
-logger = setup_logging(log_file_name=None, verbose=True)
+logger = getLogger()
 
 TIME_TO_RUN = -1  # Run indefinitely
 
@@ -45,24 +50,80 @@ SECONDS_BETWEEN_EMAIL_UPDATES = 3600 * 24
 # For now, we're checking only once every two minutes
 SECONDS_BETWEEN_CALLS = 120
 
+# Maximum page size for a search.list call
+MAX_RESULTS_PER_CALL = 50
+
+# Collected videos are kept in a write-ahead log until saved, so they survive a crash or restart and can
+# be saved in large, efficient batches. Save once either threshold is reached.
+# Override with SAMPLE_WAL_FILE, SAMPLE_FLUSH_ROWS and SAMPLE_FLUSH_SECONDS in config.yml.
+DEFAULT_WAL_FILE = 'data/youtube_sample.wal'
+DEFAULT_FLUSH_ROWS = 5000
+DEFAULT_FLUSH_SECONDS = 600
+
 def main():
-    videos = []
+    """ Collect a random sample of new YouTube videos
+
+    Usage:
+      youtube_sample.py [--profile] [--profile_sampling=seconds] [--profile_file=file]
+
+    Options:
+      -h --help                 Show this screen.
+      --profile                 Time each pipeline stage and add the breakdown to the run summary and profile file
+      --profile_sampling=seconds  With --profile, also run cProfile and tracemalloc for this many seconds at the start [default: 0]
+      --profile_file=file       Where to write the profile [default: data/profile_youtube_sample.json]
+
+    """
+
+    args = docopt(main.__doc__, version='YouTube Random Sampler 0.1')
+
+    setup_logging(log_file_name=None, verbose=True)
+    if args['--profile']:
+        PROFILER.start(sampling_seconds=float(args['--profile_sampling']))
+    if cfg.get('METRICS_PORT'):
+        start_metrics_server(cfg['METRICS_PORT'])
+
+    # Stop cleanly on Ctrl-C or SIGTERM, so the write-ahead log is synced and the profile written
+    stop_event = threading.Event()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signal_number, lambda signum, frame: stop_event.set())
+
+    run_sampler(stop_event=stop_event, profile_file=args['--profile_file'] if args['--profile'] else None)
+    print_run_summary("{} stopped".format(MODULE_FRIENDLY_IDENTIFIER))
+
+
+def run_sampler(stop_event=None, bq_client=None, profile_file=None):
+    """ Collect the random sample until stop_event is set (or forever, if there is no stop_event).
+
+        Pass a bq_client to reuse it for every save; otherwise a new client is created for each save.
+        With a profile_file, the stage profile is written to it with every regular update and on stopping. """
     youtube = None
+    stop_event = stop_event or threading.Event()
+
+    flush_rows = cfg.get('SAMPLE_FLUSH_ROWS') or DEFAULT_FLUSH_ROWS
+    flush_seconds = cfg.get('SAMPLE_FLUSH_SECONDS') or DEFAULT_FLUSH_SECONDS
+    wal = WriteAheadLog(cfg.get('SAMPLE_WAL_FILE') or DEFAULT_WAL_FILE)
+    videos = wal.recover()
+    if videos:
+        logger.info("Recovered {} unsaved videos from write-ahead log {}.".format(len(videos), wal.file_name))
+    QUEUE_DEPTH.set(len(videos))
 
     start_time = datetime.datetime.utcnow()  # grabs the system time
-    logger.info("Starting scrape from Youtube, running every {} seconds.".format(SECONDS_BETWEEN_CALLS))
+    logger.info("Starting scrape from Youtube, running every {} seconds. Saving every {} videos or {} seconds.".format(
+        SECONDS_BETWEEN_CALLS, flush_rows, flush_seconds))
     next_summary_time = datetime.datetime.utcnow() + datetime.timedelta(
         seconds=SECONDS_BETWEEN_EMAIL_UPDATES)
     last_save_time = start_time
-    while True:
+    save_failed = False
+    while not stop_event.is_set():
         try:
             run_time = datetime.datetime.utcnow()
-            if not youtube or start_time < (
-                    run_time + datetime.timedelta(hours=1)):  # refresh youtube token every hour
+            if not youtube or run_time - start_time > datetime.timedelta(hours=1):  # refresh youtube client every hour
                 youtube = yt_get_client(cfg['DEVELOPER_KEY'])
                 start_time = run_time
 
             if datetime.datetime.utcnow() > next_summary_time:
+                if profile_file:
+                    PROFILER.write(profile_file)
                 print_run_summary("{} regular update".format(MODULE_FRIENDLY_IDENTIFIER))
                 next_summary_time = run_time + datetime.timedelta(
                     seconds=SECONDS_BETWEEN_EMAIL_UPDATES)
@@ -76,31 +137,63 @@ def main():
                 video['search_time'] = run_time
                 video['study_group'] = "random sample"
                 video['observatory_data_source'] = 'YouTube random sample'
-                videos.append(video)
+            with stage('wal_append'):
+                wal.append(new_vids)
+            videos.extend(new_vids)
+            QUEUE_DEPTH.set(len(videos))
+
+            seconds_since_save = (datetime.datetime.utcnow() - last_save_time).total_seconds()
+            # After a failed save, wait flush_seconds before trying again, however many videos are waiting
+            if videos and (seconds_since_save >= flush_seconds or (len(videos) >= flush_rows and not save_failed)):
+                saved = False
+                try:
+                    saved = save_videos(wal, videos, bq_client=bq_client)
+                finally:
+                    save_failed = not saved
+                    time_taken = datetime.datetime.utcnow() - last_save_time
+                    last_save_time = datetime.datetime.utcnow()
+
+                if saved:
+                    logger.debug(
+                        "Received and saved {} videos in {} seconds. {} videos per second throughput.".format(len(videos),
+                                      time_taken.total_seconds(), (len(videos) / time_taken.total_seconds())))
+                    videos = []
+                    QUEUE_DEPTH.set(0)
+
+            stop_event.wait(SECONDS_BETWEEN_CALLS)
 
-            if len(videos) >= 250:
-                bq_client, bq_storage_client = bq_get_clients(project_id=cfg['PROJECT_ID'], json_key_file=cfg['BQ_KEY_FILE'])
-                logger.info("Saving {} videos to BigQuery.".format(len(videos)))
-                data_prefix = format(
-                    datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S'))
-                upload_rows(SCHEMA_YOUTUBE_SEARCH_RESULTS, videos, bq_client, cfg['DATASET'], cfg['SAVE_TABLE_SEARCH'],
-                                   backup_file_name=None)
+        except Exception as e:
+            send_exception(module_name=MODULE_FRIENDLY_IDENTIFIER, message="Problem getting videos",
+                           message_body="Problem getting videos: {}".format(e))
+            stop_event.wait(30)
 
-                time_taken = datetime.datetime.utcnow() - last_save_time
-                logger.debug(
-                    "Received and saved {} videos in {} seconds. {} videos per second throughput.".format(len(videos),
-                                  time_taken.total_seconds(), (time_taken.total_seconds() / len(videos))))
-                last_save_time = datetime.datetime.utcnow()
+    # Unsaved videos stay in the write-ahead log for the next run
+    wal.close()
+    if profile_file:
+        PROFILER.write(profile_file)
+    logger.info("Stopped random sampler with {} unsaved videos in write-ahead log {}.".format(len(videos), wal.file_name))
 
-                videos = []
 
-            time.sleep(SECONDS_BETWEEN_CALLS)
+def save_videos(wal, videos, bq_client=None, save_func=save_rows):
+    """ Save videos to the output sinks, then empty the write-ahead log.
 
-        except Exception as e:
-            send_exception(module_name=MODULE_FRIENDLY_IDENTIFIER, message="Problem getting videos",
-                           message_body="Problem getting videos: {}".format(e))
-            time.sleep(30)
+        Returns True if the videos were saved. If not, they stay in the log, to be saved with the next batch. """
+    sinks = get_output_sinks(cfg)
+    if 'bigquery' in sinks and not bq_client:
+        bq_client, bq_storage_client = bq_get_clients(project_id=cfg['PROJECT_ID'], json_key_file=cfg['BQ_KEY_FILE'])
+    logger.info("Saving {} videos to {}.".format(len(videos), ", ".join(sinks)))
 
+    # Rows that fail to upload go to a backup file; the save only fails if that fails too
+    backup_file_name = "data/{}_sample_{}.json".format(cfg['SAVE_TABLE_SEARCH'],
+                                                       datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S'))
+    saved = save_func(SCHEMA_YOUTUBE_SEARCH_RESULTS, videos, bq_client, cfg['DATASET'], cfg['SAVE_TABLE_SEARCH'],
+                      backup_file_name=backup_file_name, sinks=sinks, parquet_dir=cfg.get('PARQUET_OUTPUT_DIR'))
+    if saved:
+        wal.truncate()
+    else:
+        logger.error("Unable to save {} videos. Keeping them in write-ahead log {} to retry.".format(
+            len(videos), wal.file_name))
+    return saved
 
 
 def get_recent_youtube_vids(youtube_client, seconds_between_calls, minutes_ago=5):
@@ -116,7 +209,7 @@ def get_recent_youtube_vids(youtube_client, seconds_between_calls, minutes_ago=5
     ts_to_str = ts_to.isoformat("T") + "Z"
 
     arguments = {"part" : "id,snippet",
-            "maxResults": "50",
+            "maxResults": str(MAX_RESULTS_PER_CALL),
             "order":"date",
             "safeSearch": "none",
             "type": "video",
@@ -125,16 +218,22 @@ def get_recent_youtube_vids(youtube_client, seconds_between_calls, minutes_ago=5
 
     videos = search_youtube(youtube_client, seconds_between_calls, **arguments)
 
+    # A full page means more videos were published in the window than we can see
+    WINDOW_SATURATION.set(len(videos) / MAX_RESULTS_PER_CALL)
+    if len(videos) >= MAX_RESULTS_PER_CALL:
+        SATURATED_WINDOWS.inc()
+
     results = []
 
     num_inaccurate_results = 0
 
-    for video in videos:
-        # discard videos not published in the interval - sometimes YouTube doesn't return accurate results.
-        if video['publishedAt'] >= pytz.timezone('UTC').localize(ts_from) and video['publishedAt'] <= pytz.timezone('UTC').localize(ts_to):
-            results.append(video)
-        else:
-            num_inaccurate_results += 1
+    with stage('window_filter'):
+        for video in videos:
+            # discard videos not published in the interval - sometimes YouTube doesn't return accurate results.
+            if video['publishedAt'] >= pytz.timezone('UTC').localize(ts_from) and video['publishedAt'] <= pytz.timezone('UTC').localize(ts_to):
+                results.append(video)
+            else:
+                num_inaccurate_results += 1
 
     logger.debug(f"Search results found {len(results)} out of {len(videos)} within timeframe. "
                  f"We discarded {num_inaccurate_results} outside of the timeframe.")
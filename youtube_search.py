@@ -7,6 +7,7 @@ Process:
 
 Input:
     Create a CSV file 'youtube_keywords.csv' with at least two columns: keyword, study_group.
+    JSON lines (.jsonl) and Parquet (.parquet) files with the same columns can also be used.
 
 Output:
     Save results to a BigQuery table (data expires in 14 days).
@@ -20,21 +21,28 @@ import datetime
 from logging.handlers import RotatingFileHandler
 
 from docopt import docopt
-import pandas as pd
-import csv
 import logging
 from config import cfg
+from keyword_yield import KeywordYieldScheduler
+from keywords import iter_keywords
+from log import getLogger as get_summary_logger, print_run_summary, start_queue_logging
+from profiler import PROFILER, stage
+from rank_snapshots import RankSnapshotStore
 
-from schemas import SCHEMA_YOUTUBE_SEARCH_RESULTS
-from utils import bq_get_clients, upload_rows, yt_get_client
+from metrics import RESULTS_PER_KEYWORD, SEARCH_QUOTA_COST, start_metrics_server
+
+from schemas import SCHEMA_YOUTUBE_RANK_CHANGES, SCHEMA_YOUTUBE_SEARCH_RESULTS
+from utils import bq_get_clients, get_output_sinks, save_rows, yt_get_client
 from youtube_utils import search_youtube
 
+SEARCH_TYPES = ['last-hour', 'top-rated', 'all-time', 'today']
+
 
 def main():
     """ Search YouTube and log results
 
     Usage:
-      youtube_search.py [-v] [-l log_file] [--search_results=s] [--search_type=type] <csv_input_file_name>
+      youtube_search.py [-v] [-l log_file] [--search_results=s] [--search_type=type] [--quota=units] [--yield_state=file] [--diff_ranks] [--rank_state=file] [--full_snapshot_every=n] [--profile] [--profile_sampling=seconds] [--profile_file=file] <csv_input_file_name>
 
     Options:
       -h --help                 Show this screen.
@@ -42,6 +50,14 @@ def main():
       -l <log_file> --log=<log_file>    Save log to file
       --search_results=s        Number of search results to save [default: 20]
       --search_type=type        Type of search (last-hour, top-rated, all-time, or today [default: today]
+      --quota=units             Quota units to spend this run. Keywords are chosen by their history of finding new videos.
+      --yield_state=file        Keyword yield history for --quota [default: data/keyword_yield_<search_type>.json]
+      --diff_ranks              Save only changes in each keyword's ranked results since the last run (for top-rated and all-time)
+      --rank_state=file         Last ranked results of each keyword for --diff_ranks [default: data/rank_snapshots_<search_type>.json]
+      --full_snapshot_every=n   With --diff_ranks, save every result for a keyword once every n runs, and at least every 13 days [default: 24]
+      --profile                 Time each pipeline stage and add the breakdown to the run summary and profile file
+      --profile_sampling=seconds  With --profile, also run cProfile and tracemalloc for this many seconds at the start [default: 0]
+      --profile_file=file       Where to write the profile [default: data/profile_youtube_search.json]
 
       --version  Show version.
 
@@ -52,29 +68,122 @@ def main():
     search_type = ''.join(args['--search_type'])
 
     setup_logging(log_file_name=args['--log'], verbose=args['--verbose'])
-    
-    keywords = get_keywords(args['<csv_input_file_name>'])
-    search_youtube_keywords(keywords, max_search_results, search_type)
 
+    if args['--profile']:
+        PROFILER.start(sampling_seconds=float(args['--profile_sampling']))
+
+    if cfg.get('METRICS_PORT'):
+        start_metrics_server(cfg['METRICS_PORT'])
 
-def search_youtube_keywords(keywords, max_search_results, search_type):
-    logging.info(f"Starting to collect search results from {len(keywords)} keywords.")
+    yield_scheduler = None
+    if args['--quota']:
+        state_file = args['--yield_state'].replace('<search_type>', search_type)
+        yield_scheduler = KeywordYieldScheduler(state_file)
+
+    rank_store = None
+    if args['--diff_ranks']:
+        state_file = args['--rank_state'].replace('<search_type>', search_type)
+        rank_store = RankSnapshotStore(state_file, full_snapshot_every=int(args['--full_snapshot_every']))
+
+    keywords = get_keywords(args['<csv_input_file_name>'])
+    try:
+        search_youtube_keywords(keywords, max_search_results, search_type, yield_scheduler=yield_scheduler,
+                                quota_units=int(args['--quota'] or 0), rank_store=rank_store)
+    finally:
+        # The metrics (and profile) only live as long as this process, so always report them
+        if args['--profile']:
+            PROFILER.write(args['--profile_file'])
+        print_run_summary("YouTube search ({})".format(search_type))
+
+
+def search_youtube_keywords(keywords, max_search_results, search_type, youtube_client=None, bq_client=None,
+                            yield_scheduler=None, quota_units=0, rank_store=None):
+    """ Search for each keyword and save the results. keywords can be a list or an iterator of dicts.
+
+    Pass youtube_client and bq_client to reuse existing clients; otherwise new ones are created.
+    With a yield_scheduler, only the keywords it selects for quota_units are searched.
+    With a rank_store, only results that changed since the last run are saved, plus their rank changes. """
+    if rank_store and 'bigquery' in get_output_sinks(cfg) and not cfg.get('SAVE_TABLE_RANKS'):
+        # Check before searching, so no results are saved without their rank changes
+        raise ValueError("Set SAVE_TABLE_RANKS in config.yml to save rank changes to BigQuery.")
+
+    logging.info("Starting to collect search results from keywords.")
     start_time = datetime.datetime.utcnow()
-    results = get_search_results_from_keywords(keywords, search_type=search_type, max_results=max_search_results)
+
+    if yield_scheduler:
+        # Choosing keywords needs the whole list
+        with stage('yield_select'):
+            keywords = yield_scheduler.select(keywords, search_type, quota_units)
+        logging.info(f"Keyword yield scheduler selected {len(keywords)} keywords for {quota_units} quota units.")
+
+    keyword_count = [0]
+
+    def count_keywords(entries):
+        for entry in entries:
+            keyword_count[0] += 1
+            yield entry
+
+    failed_keywords = []
+    results = get_search_results_from_keywords(count_keywords(keywords), search_type=search_type,
+                                               max_results=max_search_results, youtube_client=youtube_client,
+                                               failed_keywords=failed_keywords)
     logging.info(f"Processed search results in {datetime.datetime.utcnow() - start_time}, "
-                 f"found {len(results)} results from {len(keywords)} keywords")
+                 f"found {len(results)} results from {keyword_count[0]} keywords, {len(failed_keywords)} failed")
+
+    if yield_scheduler:
+        # Failed calls say nothing about a keyword's yield, so they are left out
+        new_videos = yield_scheduler.record(keywords, results, search_type, failed_keywords=failed_keywords)
+        yield_scheduler.save()
+        successful_calls = keyword_count[0] - len(failed_keywords)
+        logging.info(f"Found {new_videos} new videos, "
+                     f"{new_videos / max(successful_calls, 1):.1f} per {SEARCH_QUOTA_COST} unit search call.")
+
+    rank_rows = []
+    if rank_store:
+        num_results = len(results)
+        with stage('rank_diff'):
+            results, rank_rows = rank_store.diff(results, search_type)
+        logging.info(f"Rank snapshots reduced {num_results} results to {len(results)} new results "
+                     f"and {len(rank_rows)} rank changes.")
+
     # Save search results
     save_table = cfg['SAVE_TABLE_SEARCH']
     backup_file_name = "data/{}_{}.json" .format(save_table, datetime.datetime.now().strftime('%Y%m%d'))
-    bq_client, bq_storage_client = bq_get_clients(project_id=cfg['PROJECT_ID'], json_key_file=cfg['BQ_KEY_FILE'])
-    logging.info(f"Saving results to BQ {save_table} or backup file {backup_file_name}.")
-    upload_rows(SCHEMA_YOUTUBE_SEARCH_RESULTS, results, bq_client, cfg['DATASET'], save_table,
-                backup_file_name=backup_file_name)
+    sinks = get_output_sinks(cfg)
+    if 'bigquery' in sinks:
+        if not bq_client:
+            bq_client, bq_storage_client = bq_get_clients(project_id=cfg['PROJECT_ID'], json_key_file=cfg['BQ_KEY_FILE'])
+        logging.info(f"Saving results to BQ {save_table} or backup file {backup_file_name}.")
+    saved = True
+    # With rank snapshots, an unchanged result list leaves nothing to save
+    if results or not rank_store:
+        saved = save_rows(SCHEMA_YOUTUBE_SEARCH_RESULTS, results, bq_client, cfg['DATASET'], save_table,
+                          backup_file_name=backup_file_name, sinks=sinks, parquet_dir=cfg.get('PARQUET_OUTPUT_DIR'))
+
+    if rank_store:
+        ranks_table = cfg.get('SAVE_TABLE_RANKS')
+        ranks_backup_file_name = "data/{}_{}.json".format(ranks_table, datetime.datetime.now().strftime('%Y%m%d'))
+        if rank_rows:
+            saved = save_rows(SCHEMA_YOUTUBE_RANK_CHANGES, rank_rows, bq_client, cfg['DATASET'], ranks_table,
+                              backup_file_name=ranks_backup_file_name, sinks=sinks,
+                              parquet_dir=cfg.get('PARQUET_RANK_CHANGES_DIR') or 'data/parquet_rank_changes') and saved
+        # Rows that failed to upload are in the backup files, so the snapshots can move on unless that failed too
+        if saved:
+            rank_store.save()
+        else:
+            logging.error(f"Unable to save results or rank changes. Keeping the previous rank snapshots in "
+                          f"{rank_store.state_file}, so the next run saves these changes again.")
+
+    return saved
 
 
-def get_search_results_from_keywords(keywords_dicts, search_type, max_results):
-    assert search_type in ['last-hour', 'top-rated', 'all-time', 'today'], "Type must be specified."
-    youtube_client = yt_get_client(developer_key=cfg['DEVELOPER_KEY'])
+def get_search_results_from_keywords(keywords_dicts, search_type, max_results, youtube_client=None,
+                                     failed_keywords=None):
+    """ Search for each keyword and return the tagged results. If failed_keywords is a list, the keyword
+        dicts whose search failed (as opposed to finding nothing) are appended to it. """
+    assert search_type in SEARCH_TYPES, "Type must be specified."
+    if not youtube_client:
+        youtube_client = yt_get_client(developer_key=cfg['DEVELOPER_KEY'])
 
     search_results = []
     seconds_between_calls = 2
@@ -111,7 +220,14 @@ def get_search_results_from_keywords(keywords_dicts, search_type, max_results):
 
         logging.info(f'Searching for {entry}')
 
-        results = search_youtube(youtube_client=youtube_client, seconds_between_calls=seconds_between_calls, **arguments)
+        errors = []
+        results = search_youtube(youtube_client=youtube_client, seconds_between_calls=seconds_between_calls,
+                                 errors=errors, **arguments)
+        if errors:
+            if failed_keywords is not None:
+                failed_keywords.append(entry)
+            continue
+        RESULTS_PER_KEYWORD.observe(len(results), search_type=search_type)
 
         for vid in results:
             video = vid
@@ -127,20 +243,17 @@ def get_search_results_from_keywords(keywords_dicts, search_type, max_results):
     return search_results
 
 
-def get_keywords(csv_file):
-    columns = ['keyword', 'study_group']
-
-    df = pd.read_csv(csv_file, encoding='utf-8', quoting=csv.QUOTE_ALL, usecols=columns)
-    assert 'keyword' in df.columns, "Invalid CSV file. Must contain columns: keyword, study_group"
-    assert 'study_group' in df.columns, "Invalid CSV file. Must contain columns: keyword, study_group"
-
-    return df[columns].to_dict(orient='records')
+def get_keywords(keywords_file):
+    """ Return an iterator of normalised, deduplicated keyword dicts from a CSV, JSON lines or Parquet file """
+    return iter_keywords(keywords_file)
 
 
 def setup_logging(log_file_name=None, verbose=False):
     if not verbose:
-        # Quieten other loggers down a bit (particularly requests and google api client)
+        # Quieten other loggers down a bit (particularly requests and google api client), but not the run summary
         for logger_str in logging.Logger.manager.loggerDict:
+            if logger_str == get_summary_logger().name:
+                continue
             try:
                 logging.getLogger(logger_str).setLevel(logging.WARNING)
 
@@ -150,10 +263,11 @@ def setup_logging(log_file_name=None, verbose=False):
     logFormatter = logging.Formatter(
         "%(asctime)s [%(filename)-20.20s:%(lineno)-4.4s - %(funcName)-20.20s() [%(levelname)-8.8s]  %(message).5000s")
     logger = logging.getLogger()
+    handlers = []
 
     consoleHandler = logging.StreamHandler()
     consoleHandler.setFormatter(logFormatter)
-    logger.addHandler(consoleHandler)
+    handlers.append(consoleHandler)
 
     if verbose:
         consoleHandler.setLevel(logging.DEBUG)
@@ -169,9 +283,10 @@ def setup_logging(log_file_name=None, verbose=False):
         else:
             fileHandler.setLevel(logging.INFO)
 
-        logger.addHandler(fileHandler)
+        handlers.append(fileHandler)
 
-    # Add
+    # Format and write records on a background thread
+    start_queue_logging(logger, handlers)
 
     if verbose:
         logger.setLevel(logging.DEBUG)
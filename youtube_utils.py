@@ -4,19 +4,30 @@ import time
 from dateutil import parser
 from googleapiclient.errors import HttpError
 
+from metrics import API_CALL_SECONDS, API_ERRORS, QUOTA_UNITS, SEARCH_QUOTA_COST
+from profiler import stage
 
-def search_youtube(youtube_client, seconds_between_calls, **kwargs):
+
+def search_youtube(youtube_client, seconds_between_calls, errors=None, **kwargs):
+    """ Run a search.list call and return the videos found. Errors are logged and return no videos;
+        pass a list as errors to have the exception appended to it, to tell a failed call from an empty one. """
     videos = []
 
     try:
-        search_response = youtube_client.search().list(
-            **kwargs
-        ).execute()
+        # Quota is charged whether or not the call succeeds
+        QUOTA_UNITS.inc(SEARCH_QUOTA_COST)
+        with API_CALL_SECONDS.time(), stage('api_call'):
+            search_response = youtube_client.search().list(
+                **kwargs
+            ).execute()
 
         for search_result in search_response.get("items", []):
             if search_result["id"]["kind"] == "youtube#video":
                 videos.append(search_result)
     except HttpError as e:
+        API_ERRORS.inc(status=e.resp.status)
+        if errors is not None:
+            errors.append(e)
         # If the error is a rate limit or connection error, back off a bit -  usually a server problem
         if e.resp.status in [403, 500, 503]:
             time.sleep(2 * seconds_between_calls)
@@ -24,20 +35,24 @@ def search_youtube(youtube_client, seconds_between_calls, **kwargs):
         else:
             logging.error("Problem getting youtube videos: {}".format(e))
     except Exception as e:
+        API_ERRORS.inc(status='exception')
+        if errors is not None:
+            errors.append(e)
         logging.error("Problem getting youtube videos: {}".format(e))
 
     results = []
-    for video in videos:
-        rowdict = {'publishedAt': video["snippet"]["publishedAt"]}
+    with stage('parse_results'):
+        for video in videos:
+            rowdict = {'publishedAt': video["snippet"]["publishedAt"]}
 
-        if isinstance(rowdict['publishedAt'], str):
-            rowdict['publishedAt'] = parser.parse(rowdict['publishedAt'])
+            if isinstance(rowdict['publishedAt'], str):
+                rowdict['publishedAt'] = parser.parse(rowdict['publishedAt'])
 
-        rowdict['videoId'] = video["id"]["videoId"]
-        rowdict['title'] = video["snippet"]["title"]
-        rowdict['channelTitle'] = video["snippet"]["channelTitle"]
-        rowdict['description'] = video["snippet"]["description"]
+            rowdict['videoId'] = video["id"]["videoId"]
+            rowdict['title'] = video["snippet"]["title"]
+            rowdict['channelTitle'] = video["snippet"]["channelTitle"]
+            rowdict['description'] = video["snippet"]["description"]
 
-        results.append(rowdict)
+            results.append(rowdict)
 
     return results
\ No newline at end of file